@@ -8,170 +8,1835 @@ import subprocess
 import time
 import datetime
 import threading
+import queue
+import re
+import select
+import socket
+import struct
+import fnmatch
+import ipaddress
+import tempfile
+import gzip
+import shutil
+import sqlite3
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque, namedtuple
 
 import json
 
 FILES_DIR = "/home/pi/files_nmap"
+SCAN_DIR = "/home/pi/auto_nmap"
 NOSCAN_FILE = os.path.join(FILES_DIR, "ssid_noscan.txt")
 KNOWN_FILE = os.path.join(FILES_DIR, "ssid_known.json")
+# estado interno del plugin, fuera de los directorios que publica el servidor web
+STATE_DIR = "/home/pi/.auto_nmap"
+LEASES_DIR = os.path.join(STATE_DIR, "leases")
+SCAN_DB = os.path.join(STATE_DIR, "scans.db")
+SCHEDULE_FILE = os.path.join(STATE_DIR, "schedule.json")
 
-def load_ssid_data():
-    global SSID_NOSCAN, SSID_KNOWN
+LISTS_CHECK_INTERVAL = 2.0  # segundos entre comprobaciones de mtime
 
+
+def ensure_ssid_files():
     if not os.path.exists(FILES_DIR):
         os.makedirs(FILES_DIR)
-    
+
     if not os.path.exists(NOSCAN_FILE):
         with open(NOSCAN_FILE, "w") as f:
-            f.write("Club_Totalplay_WiFi\nMegacable Gratis\nCASINO_HERMOSILLO\n")
-    
+            f.write("Club_Totalplay_*\nMegacable Gratis\nCASINO_HERMOSILLO\n")
+
     if not os.path.exists(KNOWN_FILE):
         with open(KNOWN_FILE, "w") as f:
             f.write("Totalplay-CCCX PASSWORD123\nMiRedCasa123 pa55w0rd\nCafeteriaLibre 12345678\n")  # ejemplo
 
-    try:
-        with open(NOSCAN_FILE, "r") as f:
-            SSID_NOSCAN = [line.strip() for line in f if line.strip()]
-    except Exception as e:
-        logging.error(f"No se pudo cargar {NOSCAN_FILE}: {e}")
-        SSID_NOSCAN = []
 
+class NoscanMatcher:
+    # nombres exactos en un set; "*", "?" o "[" como glob y "re:" como regex, todo en un solo patrón
+    def __init__(self, entries=()):
+        self.exact = set()
+        patterns = []
+        for entry in entries:
+            if entry.startswith("re:"):
+                pattern = f"(?s:.*?)(?:{entry[3:]})"
+            elif any(char in entry for char in "*?["):
+                pattern = fnmatch.translate(entry)
+            else:
+                self.exact.add(entry)
+                continue
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                logging.error(f"Patrón noscan inválido: {entry} ({e})")
+                continue
+            patterns.append(f"(?:{pattern})")
+        self.regex = re.compile("|".join(patterns)) if patterns else None
+
+    def __contains__(self, ssid):
+        return ssid in self.exact or (self.regex is not None and self.regex.match(ssid) is not None)
+
+
+class SsidLists:
+    # recarga ssid_noscan.txt / ssid_known.json solo cuando cambia su mtime
+    def __init__(self, noscan_file=NOSCAN_FILE, known_file=KNOWN_FILE, check_interval=LISTS_CHECK_INTERVAL):
+        self.noscan_file = noscan_file
+        self.known_file = known_file
+        self.check_interval = check_interval
+        self.noscan = NoscanMatcher()
+        self.known = {}
+        self.mtimes = {}
+        self.next_check = 0.0
+        self.lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _changed(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self.mtimes.get(path, -1) == mtime:
+            return False
+        self.mtimes[path] = mtime
+        return True
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now < self.next_check:
+            return
+        with self.lock:
+            self.next_check = now + self.check_interval
+            if self._changed(self.noscan_file):
+                self.noscan = self._load_noscan()
+            if self._changed(self.known_file):
+                self.known = self._load_known()
+
+    def _load_noscan(self):
+        try:
+            with open(self.noscan_file, "r") as f:
+                matcher = NoscanMatcher(line.strip() for line in f if line.strip())
+            logging.info(f"Cargado {self.noscan_file}")
+            return matcher
+        except Exception as e:
+            logging.error(f"No se pudo cargar {self.noscan_file}: {e}")
+            return NoscanMatcher()
+
+    def _load_known(self):
+        known = {}
+        try:
+            with open(self.known_file, "r") as f:
+                for line in f:
+                    parts = line.strip().split(None, 1)  # separa solo en 2 partes: SSID y contraseña
+                    if len(parts) == 2:
+                        ssid, password = parts
+                        known[ssid] = password
+            logging.info(f"Cargado {self.known_file}")
+        except Exception as e:
+            logging.error(f"No se pudo cargar {self.known_file}: {e}")
+        return known
+
+
+READY = 0
+SCAN_QUEUE_SIZE = 4
+SCAN_INTERFACES = ["wlan1"]
+
+OPEN_ENCRYPTIONS = {"open", "none"}
+KNOWN_BONUS = 100      # las redes conocidas siempre van antes que las abiertas
+STALE_PENALTY = 0.25   # puntos por segundo desde la última vez que se vio el AP
+STALE_MAX = 120
+RETRY_PENALTY = 15     # puntos por cada intento fallido
+
+RESCAN_HOURS = 24          # una red escaneada con éxito no se repite antes de esto
+BACKOFF_BASE = 60          # segundos de espera tras el primer fallo, se duplica en cada fallo
+BACKOFF_MAX = 6 * 3600
+SCHEDULE_MAX_ENTRIES = 2000
+
+WPA_CTRL_DIR = "/var/run/wpa_supplicant"
+ASSOC_TIMEOUT = 15
+WPA_CONNECTED_EVENT = "CTRL-EVENT-CONNECTED"
+WPA_FAIL_EVENTS = (
+    "CTRL-EVENT-DISCONNECTED",
+    "CTRL-EVENT-SSID-TEMP-DISABLED",
+    "CTRL-EVENT-AUTH-REJECT",
+    "CTRL-EVENT-ASSOC-REJECT",
+    "CTRL-EVENT-NETWORK-NOT-FOUND",
+)
+
+# rtnetlink (linux/rtnetlink.h, linux/if_link.h, linux/if_addr.h)
+NETLINK_ROUTE = 0
+RTM_NEWLINK, RTM_GETLINK = 16, 18
+RTM_DELADDR, RTM_GETADDR = 21, 22
+RTM_GETROUTE = 26
+NLM_F_REQUEST, NLM_F_ACK, NLM_F_DUMP = 0x1, 0x4, 0x300
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+IFLA_OPERSTATE, IFLA_CARRIER = 16, 33
+IFA_ADDRESS, IFA_LOCAL = 1, 2
+RTA_DST, RTA_OIF, RTA_GATEWAY = 1, 4, 5
+IFF_UP = 0x1
+OPERSTATES = ["unknown", "notpresent", "down", "lowerlayerdown", "testing", "dormant", "up"]
+
+MAX_TARGETS = 256  # direcciones máximas a sondear en redes más grandes que esto
+# presupuesto de tiempo: perfil nmap según los segundos que se espera seguir en rango
+SCAN_PROFILES = [
+    (300, ["-T4", "-F"]),
+    (120, ["-T4", "--top-ports", "50"]),
+    (45, ["-T5", "--top-ports", "20"]),
+    (0, ["-T5", "--top-ports", "10"]),
+]
+FULL_PROFILE = " ".join(SCAN_PROFILES[0][1])  # solo un escaneo así vale como fingerprint de la red
+RSSI_FLOOR = -85       # dBm a partir de los que se considera perdido el enlace
+MAX_DWELL = 600        # segundos supuestos cuando la señal no baja
+MIN_BUDGET = 20
+RSSI_WINDOW = 8        # muestras por red para estimar la tendencia
+SIGNAL_MAX_NETWORKS = 512
+
+ScanBudget = namedtuple("ScanBudget", ["seconds", "args", "host_timeout", "deadline"])
+NMAP_WORKER_MEMORY = 48 * 1024 * 1024  # memoria aproximada de un nmap -F
+MEMORY_BUDGET = 0.25                   # fracción de MemAvailable para los nmap en paralelo
+
+ScanJob = namedtuple("ScanJob", ["ssid", "password", "bssid", "score"])
+
+# mantenimiento de SCAN_DIR: 0 desactiva cada límite
+LOG_COMPRESS_HOURS = 24       # gzip de los logs con más antigüedad que esto
+LOG_MAX_FILES = 5000
+LOG_MAX_DAYS = 90
+LOG_QUOTA_MB = 200
+LOG_MAINTENANCE_INTERVAL = 600
+LOG_ACTIVE_SECONDS = 900      # lo tocado hace menos que esto puede ser el escaneo en curso
+LOG_NICE = 19
+
+# los logs se escriben en RAM y pasan a SCAN_DIR en lotes, con un fsync por archivo
+STAGING_DIR = "/dev/shm/auto_nmap"
+STAGING_FLUSH_INTERVAL = 60   # copia periódica de los logs de un escaneo todavía en curso
+STAGING_PARTIAL = ".partial"
+
+# e-ink: un refresco forzado cuesta cientos de ms de SPI
+DISPLAY_MIN_INTERVAL = 5.0  # segundos mínimos entre refrescos forzados
+DISPLAY_SETTLE = 0.5        # espera para agrupar una ráfaga de cambios de estado
+
+
+def plan_targets(address, gateway=None, limit=MAX_TARGETS):
+    # devuelve (red, objetivos); si la red no cabe en el límite, gateway y vecinos primero
+    interface = ipaddress.ip_interface(address)
+    network = interface.network
+    if network.num_addresses <= limit + 2:
+        return network, [str(network)]
+
+    first = int(network.network_address) + 1
+    last = int(network.broadcast_address) - 1
+    own = int(interface.ip)
+    centers = [own]
+    if gateway and ipaddress.ip_address(gateway) in network:
+        centers.insert(0, int(ipaddress.ip_address(gateway)))
+
+    targets = []
+    seen = {own}
+    for center in centers:
+        if center not in seen:
+            seen.add(center)
+            targets.append(center)
+    distance = 1
+    while len(targets) < limit and distance <= last - first:
+        for center in centers:
+            for candidate in (center + distance, center - distance):
+                if first <= candidate <= last and candidate not in seen and len(targets) < limit:
+                    seen.add(candidate)
+                    targets.append(candidate)
+        distance += 1
+    return network, [str(ipaddress.ip_address(target)) for target in targets]
+
+
+def available_memory():
     try:
-        SSID_KNOWN = {}
-        with open(KNOWN_FILE, "r") as f:
+        with open("/proc/meminfo") as f:
             for line in f:
-                parts = line.strip().split(None, 1)  # separa solo en 2 partes: SSID y contraseña
-                if len(parts) == 2:
-                    ssid, password = parts
-                    SSID_KNOWN[ssid] = password
-    except Exception as e:
-        logging.error(f"No se pudo cargar {KNOWN_FILE}: {e}")
-        SSID_KNOWN = {}
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def scan_workers(hosts, max_workers=None, memory_budget=MEMORY_BUDGET):
+    workers = min(os.cpu_count() or 1, len(hosts))
+    if max_workers:
+        workers = min(workers, max_workers)
+    memory = available_memory()
+    if memory:
+        workers = min(workers, int(memory * memory_budget // NMAP_WORKER_MEMORY))
+    return max(1, workers)
+
+
+def nmap_done_line(outputs):
+    # pie del log con los totales de las salidas -oN de todos los shards
+    addresses = up = 0
+    elapsed = 0.0
+    for text in outputs:
+        for match in re.finditer(r"(\d+) IP address(?:es)? \((\d+) hosts? up\) scanned in ([\d.]+) seconds", text):
+            addresses += int(match.group(1))
+            up += int(match.group(2))
+            elapsed = max(elapsed, float(match.group(3)))
+    return f"# Nmap done: {addresses} IP addresses ({up} hosts up) scanned in {elapsed:.2f} seconds ({len(outputs)} shards)\n"
+
+
+class NormalOutputTail:
+    # sigue el -oN de un shard mientras nmap lo escribe y entrega solo las líneas de los bloques de host
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.buffer = ""
+        self.in_reports = False
+
+    def read(self):
+        if self.file is None:
+            try:
+                self.file = open(self.path, errors="replace")
+            except FileNotFoundError:
+                return ""
+        self.buffer += self.file.read()
+        if "\n" not in self.buffer:
+            return ""
+        text, _, self.buffer = self.buffer.rpartition("\n")
+        lines = []
+        for line in text.split("\n"):
+            if line.startswith("Nmap scan report for "):
+                self.in_reports = True
+            elif line.startswith(("# Nmap done", "Nmap done")):
+                self.in_reports = False
+                continue
+            if self.in_reports:
+                lines.append(line)
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ScanLog:
+    # log del escaneo en curso: los shards añaden cada host en cuanto nmap lo termina, así
+    # /view?tail=1 lo ve crecer
+    def __init__(self, f):
+        self.f = f
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return
+        with self.lock:
+            self.f.write(text)
+            self.f.flush()
+
+
+def parse_host(elem):
+    host = {"ip": None, "mac": None, "vendor": None, "hostname": None, "status": None, "ports": []}
+    status = elem.find("status")
+    if status is not None:
+        host["status"] = status.get("state")
+    for address in elem.findall("address"):
+        if address.get("addrtype") == "ipv4":
+            host["ip"] = address.get("addr")
+        elif address.get("addrtype") == "mac":
+            host["mac"] = address.get("addr")
+            host["vendor"] = address.get("vendor")
+    hostname = elem.find("hostnames/hostname")
+    if hostname is not None:
+        host["hostname"] = hostname.get("name")
+    for port in elem.findall("ports/port"):
+        state = port.find("state")
+        service = port.find("service")
+        host["ports"].append({
+            "port": int(port.get("portid")),
+            "proto": port.get("protocol"),
+            "state": state.get("state") if state is not None else None,
+            "service": service.get("name") if service is not None else None,
+            "product": service.get("product") if service is not None else None,
+            "version": service.get("version") if service is not None else None,
+        })
+    return host
+
+
+class NmapXmlStream:
+    # parser incremental de -oX: entrega cada <host> al cerrarse y lo descarta, memoria constante
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+        # última línea de --stats-every: (tarea, porcentaje)
+        self.progress = None
+
+    def feed(self, data):
+        self.parser.feed(data)
+        hosts = []
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+            elif elem.tag == "host":
+                hosts.append(parse_host(elem))
+                self.root.clear()
+            elif elem.tag == "taskbegin":
+                self.progress = (elem.get("task"), 0.0)
+            elif elem.tag == "taskprogress":
+                self.progress = (elem.get("task"), float(elem.get("percent", 0)))
+        return hosts
+
+
+class ScanProgress:
+    # avance agregado de los shards de un escaneo; cada hilo de nmap actualiza el suyo
+    def __init__(self, ssid):
+        self.ssid = ssid
+        self.lock = threading.Lock()
+        self.shards = {}
+        # algún host se quedó sin escanear (plazo agotado o shard fallido): no sirve de fingerprint
+        self.truncated = False
+
+    def update(self, shard, total, done, found, percent):
+        with self.lock:
+            self.shards[shard] = (total, done, found, percent)
+
+    def summary(self):
+        with self.lock:
+            shards = list(self.shards.values())
+        total = sum(shard[0] for shard in shards)
+        if not total:
+            return 0, 0
+        # hosts terminados más la parte de la tarea en curso que corresponde a los que faltan
+        done = sum(done + (total - done) * percent / 100 for total, done, _, percent in shards)
+        return min(99, int(100 * done / total)), sum(shard[2] for shard in shards)
+
+    def label(self):
+        percent, found = self.summary()
+        return f"[{percent}%]{found}h:{self.ssid[:10]}"
+
+
+class ScanStore:
+    # resultados indexados en SQLite para consultarlos sin releer los logs
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY, ssid TEXT, bssid TEXT, network TEXT, gateway TEXT,
+        started REAL, finished REAL, log_file TEXT, network_key TEXT, complete INTEGER, profile TEXT
+    );
+    CREATE TABLE IF NOT EXISTS hosts (
+        scan_id INTEGER, ip TEXT, mac TEXT, vendor TEXT, hostname TEXT,
+        PRIMARY KEY (scan_id, ip)
+    );
+    CREATE TABLE IF NOT EXISTS ports (
+        scan_id INTEGER, ip TEXT, port INTEGER, proto TEXT, state TEXT,
+        service TEXT, product TEXT, version TEXT,
+        PRIMARY KEY (scan_id, ip, port, proto)
+    );
+    CREATE INDEX IF NOT EXISTS scans_ssid ON scans (ssid);
+    CREATE INDEX IF NOT EXISTS scans_network_key ON scans (network_key);
+    CREATE INDEX IF NOT EXISTS hosts_ip ON hosts (ip);
+    CREATE INDEX IF NOT EXISTS ports_ip ON ports (ip);
+    CREATE INDEX IF NOT EXISTS ports_port ON ports (port);
+    CREATE INDEX IF NOT EXISTS ports_service ON ports (service);
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(scans)")}
+        for column, kind in (("network_key", "TEXT"), ("complete", "INTEGER"), ("profile", "TEXT")):
+            if columns and column not in columns:
+                self.db.execute(f"ALTER TABLE scans ADD COLUMN {column} {kind}")
+        self.db.executescript(self.SCHEMA)
+
+    def begin_scan(self, ssid, bssid, network, gateway, log_file, network_key=None):
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO scans (ssid, bssid, network, gateway, started, log_file, network_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ssid, bssid, str(network), gateway, time.time(), log_file, network_key),
+            )
+            return cursor.lastrowid
+
+    def open_ports(self, scan_id):
+        ports = {}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT ip, port, proto FROM ports WHERE scan_id = ? AND state = 'open'", (scan_id,)
+            ).fetchall()
+        for ip, port, proto in rows:
+            ports.setdefault(ip, set()).add((port, proto))
+        return ports
+
+    def fingerprint(self, network_key):
+        # hosts y puertos abiertos del último escaneo completo de esta red; uno cortado por el plazo
+        # o con un perfil reducido dejaría hosts sin puertos que la revisita no volvería a mirar
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, started FROM scans WHERE network_key = ? AND finished IS NOT NULL "
+                "AND complete = 1 AND profile = ? ORDER BY id DESC LIMIT 1", (network_key, FULL_PROFILE)
+            ).fetchone()
+            if row is None:
+                return None
+            hosts = self.db.execute("SELECT ip, mac FROM hosts WHERE scan_id = ?", (row[0],)).fetchall()
+        ports = self.open_ports(row[0])
+        return {
+            "scan_id": row[0],
+            "started": row[1],
+            "hosts": {ip: {"mac": mac, "ports": ports.get(ip, set())} for ip, mac in hosts},
+        }
+
+    def add_hosts(self, scan_id, hosts):
+        with self.lock, self.db:
+            for host in hosts:
+                self.db.execute(
+                    "INSERT INTO hosts (scan_id, ip, mac, vendor, hostname) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (scan_id, ip) DO UPDATE SET mac = coalesce(excluded.mac, mac), "
+                    "vendor = coalesce(excluded.vendor, vendor), hostname = coalesce(excluded.hostname, hostname)",
+                    (scan_id, host["ip"], host["mac"], host["vendor"], host["hostname"]),
+                )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO ports VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (scan_id, host["ip"], port["port"], port["proto"], port["state"],
+                         port["service"], port["product"], port["version"])
+                        for port in host["ports"]
+                    ],
+                )
+
+    def finish_scan(self, scan_id, complete=True, profile=None):
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE scans SET finished = ?, complete = ?, profile = ? WHERE id = ?",
+                (time.time(), int(complete), profile, scan_id),
+            )
+
+
+def network_key(ssid, gateway_mac):
+    # SSID + MAC del gateway: el mismo nombre en otro sitio es otra red
+    return f"{ssid}|{(gateway_mac or '').lower()}"
+
+
+def same_mac(previous, current):
+    return not previous or not current or previous.lower() == current.lower()
+
+
+def format_ports(ports):
+    return " ".join(f"{port}/{proto}" for port, proto in sorted(ports)) or "-"
+
+
+def delta_report(ssid, previous, discovered, current):
+    # compara el fingerprint anterior con los hosts y puertos de este escaneo
+    started = datetime.datetime.fromtimestamp(previous["started"]).strftime("%Y-%m-%d %H:%M:%S")
+    lines = [f"# Delta de {ssid} frente al escaneo #{previous['scan_id']} ({started})"]
+    unchanged = 0
+    live = {host["ip"]: host for host in discovered}
+    for ip, host in live.items():
+        before = previous["hosts"].get(ip)
+        now = current.get(ip, set())
+        if before is None or not same_mac(before["mac"], host["mac"]):
+            lines.append(f"+ {ip} {host['mac'] or ''} nuevo: {format_ports(now)}")
+        elif now != before["ports"]:
+            opened = now - before["ports"]
+            closed = before["ports"] - now
+            lines.append(f"~ {ip} abiertos: {format_ports(opened)} cerrados: {format_ports(closed)}")
+        else:
+            unchanged += 1
+    for ip in previous["hosts"]:
+        if ip not in live:
+            lines.append(f"- {ip} ya no responde")
+    lines.append(f"= {unchanged} hosts sin cambios")
+    return "\n".join(lines) + "\n"
+
+
+def wifi_interfaces():
+    # descubrimiento hotplug: todas las wlanX salvo la del pwnagotchi (wlan0 / modo monitor)
+    return sorted(
+        name for _, name in socket.if_nameindex()
+        if name.startswith("wlan") and name != "wlan0" and not name.endswith("mon")
+    )
+
+
+def plan_budget(seconds):
+    seconds = max(seconds, MIN_BUDGET)
+    args = next(args for minimum, args in SCAN_PROFILES if seconds >= minimum)
+    # un host lento no puede comerse más de la mitad del presupuesto
+    host_timeout = max(10, int(seconds * 0.5))
+    return ScanBudget(seconds, args, host_timeout, time.monotonic() + seconds)
+
+
+class SignalTracker:
+    # historial de RSSI por SSID para estimar cuánto tiempo seguiremos en rango
+    def __init__(self, window=RSSI_WINDOW, max_networks=SIGNAL_MAX_NETWORKS):
+        self.window = window
+        self.max_networks = max_networks
+        self.history = OrderedDict()
+        # el callback añade muestras mientras los workers calculan la tendencia
+        self.lock = threading.Lock()
+
+    def observe(self, index, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for ssid, ap in index.items():
+                rssi = ap.get("rssi")
+                if rssi is None:
+                    continue
+                samples = self.history.pop(ssid, None) or deque(maxlen=self.window)
+                samples.append((now, rssi))
+                self.history[ssid] = samples
+            while len(self.history) > self.max_networks:
+                self.history.popitem(last=False)
+
+    def time_in_range(self, ssid, floor=RSSI_FLOOR, horizon=MAX_DWELL, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            samples = list(self.history.get(ssid, ()))
+        if not samples:
+            return horizon
+        last_time, last_rssi = samples[-1]
+        if last_rssi <= floor:
+            return 0.0
+        remaining = horizon
+        if len(samples) >= 2:
+            # pendiente por mínimos cuadrados en dBm/s
+            mean_t = sum(t for t, _ in samples) / len(samples)
+            mean_r = sum(r for _, r in samples) / len(samples)
+            var_t = sum((t - mean_t) ** 2 for t, _ in samples)
+            if var_t > 0:
+                slope = sum((t - mean_t) * (r - mean_r) for t, r in samples) / var_t
+                if slope < 0:
+                    remaining = min(horizon, (last_rssi - floor) / -slope)
+        return max(0.0, remaining - (now - last_time))
+
+
+def ap_ssid(ap):
+    return ap.get("hostname") or ap.get("ssid")
+
+
+def seen_age(ap, now):
+    # bettercap usa ISO 8601 con nanosegundos, que fromisoformat no siempre acepta
+    seen = ap.get("last_seen")
+    if not seen:
+        return 0.0
+    try:
+        dt = datetime.datetime.fromisoformat(re.sub(r"\.\d+", "", seen).replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    return max(0.0, now - dt.timestamp())
+
+
+class IfaceControl:
+    # direcciones, estado del enlace y up/down por rtnetlink sin lanzar procesos; "ip" como respaldo
+    def __init__(self, use_netlink=True):
+        self.use_netlink = use_netlink and hasattr(socket, "AF_NETLINK")
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def exists(interface):
+        try:
+            socket.if_nametoindex(interface)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _attrs(body, offset):
+        attrs = {}
+        while offset + 4 <= len(body):
+            length, kind = struct.unpack_from("=HH", body, offset)
+            if length < 4:
+                break
+            attrs[kind] = body[offset + 4:offset + length]
+            offset += (length + 3) & ~3
+        return attrs
+
+    def _request(self, msg_type, flags, payload):
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        if not flags & NLM_F_DUMP:
+            flags |= NLM_F_ACK
+        header = struct.pack("=LHHLL", 16 + len(payload), msg_type, flags | NLM_F_REQUEST, seq, 0)
+        messages = []
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+            sock.bind((0, 0))
+            sock.send(header + payload)
+            while True:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + 16 <= len(data):
+                    length, kind, _, _, _ = struct.unpack_from("=LHHLL", data, offset)
+                    body = data[offset + 16:offset + length]
+                    offset += (length + 3) & ~3
+                    if kind == NLMSG_DONE:
+                        return messages
+                    if kind == NLMSG_ERROR:
+                        error = struct.unpack_from("=i", body)[0]
+                        if error:
+                            raise OSError(-error, os.strerror(-error))
+                        return messages
+                    messages.append((kind, body))
+
+    def _netlink_addresses(self, index):
+        addresses = []
+        payload = struct.pack("=BBBBI", socket.AF_INET, 0, 0, 0, 0)
+        for _, body in self._request(RTM_GETADDR, NLM_F_DUMP, payload):
+            _, prefixlen, _, _, addr_index = struct.unpack_from("=BBBBI", body)
+            if addr_index != index:
+                continue
+            attrs = self._attrs(body, 8)
+            address = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+            if address:
+                addresses.append(f"{socket.inet_ntoa(address)}/{prefixlen}")
+        return addresses
+
+    def addresses(self, interface):
+        # IPv4 en formato "ip/prefijo", como la línea inet de "ip addr show"
+        if self.use_netlink:
+            try:
+                return self._netlink_addresses(socket.if_nametoindex(interface))
+            except OSError as e:
+                logging.debug(f"netlink no disponible para {interface}: {e}")
+        output = subprocess.check_output(["ip", "-4", "-o", "addr", "show", "dev", interface]).decode()
+        return [line.split()[3] for line in output.splitlines() if " inet " in line]
+
+    def gateway(self, interface):
+        if self.use_netlink:
+            try:
+                index = socket.if_nametoindex(interface)
+                payload = struct.pack("=BBBBBBBBI", socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+                for _, body in self._request(RTM_GETROUTE, NLM_F_DUMP, payload):
+                    dst_len = body[1]
+                    attrs = self._attrs(body, 12)
+                    oif = attrs.get(RTA_OIF)
+                    if dst_len == 0 and RTA_GATEWAY in attrs and oif and struct.unpack("=I", oif)[0] == index:
+                        return socket.inet_ntoa(attrs[RTA_GATEWAY])
+                return None
+            except OSError as e:
+                logging.debug(f"netlink no disponible para {interface}: {e}")
+        output = subprocess.check_output(["ip", "-4", "route", "show", "default", "dev", interface]).decode()
+        for line in output.splitlines():
+            parts = line.split()
+            if "via" in parts:
+                return parts[parts.index("via") + 1]
+        return None
+
+    def link(self, interface):
+        if self.use_netlink:
+            try:
+                payload = struct.pack("=BxHiII", socket.AF_UNSPEC, 0, socket.if_nametoindex(interface), 0, 0)
+                for _, body in self._request(RTM_GETLINK, 0, payload):
+                    flags = struct.unpack_from("=BxHiII", body)[3]
+                    attrs = self._attrs(body, 16)
+                    operstate = attrs.get(IFLA_OPERSTATE, b"\0")[0]
+                    # IFLA_CARRIER no mira IFF_UP; "ip" solo muestra LOWER_UP con la interfaz arriba
+                    return {
+                        "up": bool(flags & IFF_UP),
+                        "carrier": bool(flags & IFF_UP) and attrs.get(IFLA_CARRIER, b"\0")[0] == 1,
+                        "operstate": OPERSTATES[operstate] if operstate < len(OPERSTATES) else "unknown",
+                    }
+            except OSError as e:
+                logging.debug(f"netlink no disponible para {interface}: {e}")
+        output = subprocess.check_output(["ip", "-o", "link", "show", "dev", interface]).decode()
+        flags = output.split("<", 1)[1].split(">", 1)[0].split(",") if "<" in output else []
+        state = output.split(" state ", 1)[1].split()[0].lower() if " state " in output else "unknown"
+        return {"up": "UP" in flags, "carrier": "LOWER_UP" in flags, "operstate": state}
+
+    def set_link(self, interface, up):
+        if self.use_netlink:
+            try:
+                index = socket.if_nametoindex(interface)
+                payload = struct.pack("=BxHiII", socket.AF_UNSPEC, 0, index, IFF_UP if up else 0, IFF_UP)
+                self._request(RTM_NEWLINK, 0, payload)
+                return
+            except OSError as e:
+                logging.debug(f"netlink no disponible para {interface}: {e}")
+        subprocess.run(["ip", "link", "set", interface, "up" if up else "down"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def flush_addresses(self, interface):
+        if self.use_netlink:
+            try:
+                index = socket.if_nametoindex(interface)
+                for address in self._netlink_addresses(index):
+                    ip, prefixlen = address.split("/")
+                    packed = socket.inet_aton(ip)
+                    attr = struct.pack("=HH", 8, IFA_LOCAL) + packed
+                    payload = struct.pack("=BBBBI", socket.AF_INET, int(prefixlen), 0, 0, index) + attr
+                    self._request(RTM_DELADDR, 0, payload)
+                return
+            except OSError as e:
+                logging.debug(f"netlink no disponible para {interface}: {e}")
+        subprocess.run(["ip", "-4", "addr", "flush", "dev", interface],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class WpaCtrl:
+    # cliente mínimo del socket de control de wpa_supplicant (como wpa_cli)
+    def __init__(self, ctrl_path):
+        self.ctrl_path = ctrl_path
+        self.local_path = f"/tmp/auto_nmap_ctrl_{os.getpid()}_{id(self)}"
+        self.sock = None
+        self.events = []
+
+    def open(self, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(self.ctrl_path):
+            if time.monotonic() >= deadline:
+                raise FileNotFoundError(self.ctrl_path)
+            time.sleep(0.05)
+        if os.path.exists(self.local_path):
+            os.unlink(self.local_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(self.local_path)
+            sock.connect(self.ctrl_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if os.path.exists(self.local_path):
+            os.unlink(self.local_path)
+
+    def _recv(self, timeout):
+        ready, _, _ = select.select([self.sock], [], [], max(0.0, timeout))
+        if not ready:
+            return None
+        return self.sock.recv(4096).decode(errors="replace")
+
+    def request(self, command, timeout=2.0):
+        self.sock.send(command.encode())
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self._recv(deadline - time.monotonic())
+            if data is None:
+                raise TimeoutError(f"wpa_supplicant no respondió a {command}")
+            if data.startswith("<"):
+                # evento no solicitado que llegó antes de la respuesta
+                self.events.append(data)
+                continue
+            return data.strip()
+
+    def attach(self):
+        if self.request("ATTACH") != "OK":
+            raise OSError(f"ATTACH rechazado por {self.ctrl_path}")
+
+    def wait_event(self, prefixes, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            while self.events:
+                event = self.events.pop(0)
+                event = event.split(">", 1)[1] if event.startswith("<") else event
+                if event.startswith(prefixes):
+                    return event
+            data = self._recv(deadline - time.monotonic())
+            if data is None:
+                return None
+            self.events.append(data)
+
+    def flush_events(self):
+        self.events.clear()
+        while self._recv(0) is not None:
+            pass
+
+    def wait_connected(self, timeout):
+        # requiere ATTACH previo para no perder un CONNECTED que llegue antes de STATUS
+        if "wpa_state=COMPLETED" in self.request("STATUS"):
+            return True
+        event = self.wait_event((WPA_CONNECTED_EVENT,) + WPA_FAIL_EVENTS, timeout)
+        if event is None:
+            logging.warning(f"Tiempo de asociación agotado ({timeout}s)")
+            return False
+        if not event.startswith(WPA_CONNECTED_EVENT):
+            logging.warning(f"Asociación fallida: {event}")
+            return False
+        return True
+
+
+class Supplicant:
+    # un wpa_supplicant de larga vida por interfaz, reconfigurado por su socket de control
+    def __init__(self, interface):
+        self.interface = interface
+        self.config_path = f"/tmp/wpa_{interface}.conf"
+        self.ctrl = None
+        self.lock = threading.Lock()
+
+    def _command(self, command):
+        reply = self.ctrl.request(command)
+        if reply != "OK":
+            raise OSError(f"wpa_supplicant rechazó '{command.split(' psk ')[0]}': {reply}")
+
+    def _ensure(self):
+        if self.ctrl is not None:
+            try:
+                if self.ctrl.request("PING") == "PONG":
+                    return
+            except OSError:
+                pass
+            self.ctrl.close()
+            self.ctrl = None
+
+        ctrl = WpaCtrl(os.path.join(WPA_CTRL_DIR, self.interface))
+        try:
+            # reutiliza un wpa_supplicant que ya esté corriendo en la interfaz
+            ctrl.open(timeout=0)
+            if ctrl.request("PING") != "PONG":
+                raise OSError("PING sin respuesta")
+        except OSError:
+            ctrl.close()
+            logging.info(f"Iniciando wpa_supplicant en {self.interface}")
+            with open(self.config_path, "w") as f:
+                f.write(f"ctrl_interface={WPA_CTRL_DIR}\nupdate_config=0\n")
+            subprocess.run(["wpa_supplicant", "-B", "-i", self.interface, "-c", self.config_path], check=True)
+            ctrl.open()
+        ctrl.attach()
+        self.ctrl = ctrl
+
+    def connect(self, ssid, password, timeout):
+        with self.lock:
+            self._ensure()
+            self._command("REMOVE_NETWORK all")
+            self.ctrl.flush_events()
+            net_id = self.ctrl.request("ADD_NETWORK")
+            # el SSID en hexadecimal evita problemas con comillas y caracteres raros
+            self._command(f"SET_NETWORK {net_id} ssid {ssid.encode().hex()}")
+            if password is None:
+                self._command(f"SET_NETWORK {net_id} key_mgmt NONE")
+            else:
+                self._command(f'SET_NETWORK {net_id} psk "{password}"')
+            self._command(f"SELECT_NETWORK {net_id}")
+            return self.ctrl.wait_connected(timeout)
+
+    def disconnect(self):
+        with self.lock:
+            if self.ctrl is None:
+                return
+            connected = "wpa_state=COMPLETED" in self.ctrl.request("STATUS")
+            self._command("REMOVE_NETWORK all")
+            if connected:
+                # consume el DISCONNECTED para que no contamine el siguiente connect
+                self.ctrl.wait_event(("CTRL-EVENT-DISCONNECTED",), 1.0)
+
+    def terminate(self):
+        with self.lock:
+            if self.ctrl is None:
+                return
+            try:
+                self.ctrl.request("TERMINATE")
+            except OSError:
+                pass
+            self.ctrl.close()
+            self.ctrl = None
+
+
+class LeaseCache:
+    # guarda el último lease por BSSID/SSID para que dhclient haga INIT-REBOOT
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_time = 0.0
+        self.miss_time = 0.0
+
+    def _paths(self, ssid, bssid):
+        paths = []
+        if bssid:
+            paths.append(os.path.join(self.directory, f"bssid_{bssid.replace(':', '').lower()}.lease"))
+        if ssid:
+            paths.append(os.path.join(self.directory, f"ssid_{ssid.encode().hex()}.lease"))
+        return paths
+
+    @staticmethod
+    def _last_lease(text):
+        leases = re.findall(r"lease \{.*?\n\}", text, re.DOTALL)
+        return leases[-1] if leases else None
+
+    @staticmethod
+    def address(lease):
+        match = re.search(r"fixed-address ([\d.]+);", lease or "")
+        return match.group(1) if match else None
+
+    @staticmethod
+    def _expired(lease):
+        match = re.search(r"expire epoch (\d+);", lease)
+        if match:
+            return int(match.group(1)) <= time.time()
+        match = re.search(r"expire \d+ (\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2});", lease)
+        if not match:
+            return True
+        expire = datetime.datetime.strptime(match.group(1), "%Y/%m/%d %H:%M:%S")
+        return expire.replace(tzinfo=datetime.timezone.utc).timestamp() <= time.time()
+
+    def lookup(self, ssid, bssid):
+        for path in self._paths(ssid, bssid):
+            try:
+                with open(path) as f:
+                    lease = self._last_lease(f.read())
+            except OSError:
+                continue
+            if lease and not self._expired(lease):
+                return lease
+        return None
+
+    def store(self, ssid, bssid, lease_file):
+        # devuelve el lease obtenido, o None si dhclient no dejó ninguno
+        try:
+            with open(lease_file) as f:
+                lease = self._last_lease(f.read())
+        except OSError:
+            return None
+        if not lease:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        for path in self._paths(ssid, bssid):
+            with open(path, "w") as f:
+                f.write(lease + "\n")
+        return lease
+
+    def record(self, hit, elapsed):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_time += elapsed
+            else:
+                self.misses += 1
+                self.miss_time += elapsed
+
+    def stats(self):
+        with self.lock:
+            avg_hit = self.hit_time / self.hits if self.hits else 0.0
+            avg_miss = self.miss_time / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "avg_hit": avg_hit,
+                "avg_miss": avg_miss,
+                "saved": (avg_miss - avg_hit) * self.hits if self.hits and self.misses else 0.0,
+            }
+
+
+class ScanScheduler:
+    # estado por SSID en disco: [último éxito, último fallo, fallos seguidos], LRU acotado
+    def __init__(self, path, ttl=RESCAN_HOURS * 3600, backoff_base=BACKOFF_BASE,
+                 backoff_max=BACKOFF_MAX, max_entries=SCHEDULE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for ssid, entry in data.items():
+            if isinstance(entry, list) and len(entry) == 3:
+                self.entries[ssid] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def attempts(self, ssid):
+        entry = self.entries.get(ssid)
+        return entry[2] if entry else 0
+
+    def due(self, ssid, now=None):
+        entry = self.entries.get(ssid)
+        if entry is None:
+            return True
+        now = time.time() if now is None else now
+        last_ok, last_fail, attempts = entry
+        if attempts:
+            backoff = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+            return now - last_fail >= backoff
+        return now - last_ok >= self.ttl
+
+    def record(self, ssid, success):
+        now = time.time()
+        with self.lock:
+            last_ok, last_fail, attempts = self.entries.pop(ssid, [0, 0, 0])
+            if success:
+                self.entries[ssid] = [now, last_fail, 0]
+            else:
+                self.entries[ssid] = [last_ok, now, attempts + 1]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            try:
+                self.save()
+            except OSError as e:
+                logging.error(f"No se pudo guardar {self.path}: {e}")
+
+
+class CandidateSelector:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def index(self, access_points):
+        # un solo recorrido: SSID -> AP con mejor señal
+        index = {}
+        for ap in access_points:
+            ssid = ap_ssid(ap)
+            if not ssid:
+                continue
+            best = index.get(ssid)
+            if best is None or ap.get("rssi", -100) > best.get("rssi", -100):
+                index[ssid] = ap
+        return index
+
+    def score(self, ssid, ap, is_known, now):
+        score = ap.get("rssi", -100)
+        score -= min(seen_age(ap, now), STALE_MAX) * STALE_PENALTY
+        score -= self.scheduler.attempts(ssid) * RETRY_PENALTY
+        if is_known:
+            score += KNOWN_BONUS
+        return score
+
+    def rank(self, index, known, noscan):
+        now = time.time()
+        ranked = []
+        for ssid, ap in index.items():
+            if not self.scheduler.due(ssid, now):
+                continue
+            password = known.get(ssid)
+            if password is None:
+                if ap.get("encryption", "unknown").lower() not in OPEN_ENCRYPTIONS:
+                    continue
+                if ssid in noscan:
+                    logging.debug(f"Descartando red abierta: {ssid}")
+                    continue
+            ranked.append(ScanJob(ssid, password, ap.get("mac"), self.score(ssid, ap, password is not None, now)))
+        ranked.sort(key=lambda job: job.score, reverse=True)
+        return ranked
+
+
+class DisplayCoalescer:
+    # agrupa cambios de hello_status: solo se fuerza el último texto de una ráfaga, como mucho uno
+    # cada min_interval, y ninguno si ese texto ya está en pantalla
+    def __init__(self, refresh, min_interval=DISPLAY_MIN_INTERVAL, settle=DISPLAY_SETTLE):
+        self.refresh = refresh
+        self.min_interval = min_interval
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.latest = None
+        self.shown = None
+        self.last_refresh = float("-inf")
+        self.timer = None
+
+    def post(self, text):
+        with self.lock:
+            self.latest = text
+            if text == self.shown or self.timer is not None:
+                return
+            delay = max(self.settle, self.last_refresh + self.min_interval - time.monotonic())
+            self.timer = threading.Timer(delay, self._flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def rendered(self, text):
+        # lo llama on_ui_update: cualquier refresco, forzado o periódico, deja el texto en pantalla
+        with self.lock:
+            self.shown = text
+
+    def _flush(self):
+        with self.lock:
+            self.timer = None
+            if self.latest == self.shown:
+                return
+            self.last_refresh = time.monotonic()
+        self.refresh()
+
+    def cancel(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+class LogMaintainer:
+    # comprime los logs viejos y poda por número, edad y cuota de disco, en un hilo de prioridad mínima
+    def __init__(self, directory, compress_hours=LOG_COMPRESS_HOURS, max_files=LOG_MAX_FILES,
+                 max_days=LOG_MAX_DAYS, quota_mb=LOG_QUOTA_MB, interval=LOG_MAINTENANCE_INTERVAL):
+        self.directory = directory
+        self.compress_after = compress_hours * 3600
+        self.max_files = max_files
+        self.max_age = max_days * 86400
+        self.quota = quota_mb * 1024 * 1024
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        try:
+            # nice es por hilo en Linux: solo este cede la CPU
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOG_NICE)
+        except (AttributeError, OSError):
+            pass
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except OSError as e:
+                logging.error(f"Error en el mantenimiento de {self.directory}: {e}")
+
+    def _logs(self):
+        logs = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".gz.tmp"):
+                    # compresión interrumpida: el original sigue intacto
+                    os.unlink(entry.path)
+                elif entry.name.endswith((".log", ".log.gz")) and entry.is_file():
+                    st = entry.stat()
+                    logs.append([entry.path, st.st_mtime, st.st_size])
+        return logs
+
+    def _compress(self, path, mtime):
+        target = path + ".gz"
+        with open(path, "rb") as src, gzip.open(target + ".tmp", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 64 * 1024)
+        # conserva la fecha: la rotación y el listado siguen ordenando por la del escaneo
+        os.utime(target + ".tmp", (mtime, mtime))
+        os.replace(target + ".tmp", target)
+        os.unlink(path)
+        return target
+
+    def run_once(self, now=None):
+        if not os.path.isdir(self.directory):
+            return
+        now = now or time.time()
+        logs = sorted(self._logs(), key=lambda log: log[1])
+        # primero edad y número, para no comprimir lo que se va a borrar; después la cuota, ya comprimido
+        removed = 0
+        while logs and now - logs[0][1] > LOG_ACTIVE_SECONDS:
+            expired = self.max_age and now - logs[0][1] > self.max_age
+            if not (expired or (self.max_files and len(logs) > self.max_files)):
+                break
+            os.unlink(logs.pop(0)[0])
+            removed += 1
+        for log in logs:
+            if self.stop_event.is_set():
+                return
+            path, mtime, _ = log
+            if self.compress_after and path.endswith(".log") and now - mtime > self.compress_after:
+                log[0] = self._compress(path, mtime)
+                log[2] = os.path.getsize(log[0])
+        total = sum(log[2] for log in logs)
+        while self.quota and total > self.quota and logs and now - logs[0][1] > LOG_ACTIVE_SECONDS:
+            path, _, size = logs.pop(0)
+            os.unlink(path)
+            total -= size
+            removed += 1
+        if removed:
+            logging.info(f"Mantenimiento de logs: {removed} borrados, quedan {len(logs)} ({total // 1024} KB)")
+
+
+class LogStager:
+    # escritura de logs en tmpfs; flush() los copia a la SD de una vez (escritura, fsync y rename atómico)
+    # y recover() rescata al arrancar lo que quedó en RAM o a medio copiar
+    def __init__(self, target, staging=STAGING_DIR, interval=STAGING_FLUSH_INTERVAL):
+        self.target = target
+        self.interval = interval
+        self.lock = threading.Lock()
+        # nombre -> (terminado, (tamaño, mtime) de la última copia)
+        self.staged = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        try:
+            os.makedirs(staging, exist_ok=True)
+            self.staging = staging
+        except OSError as e:
+            logging.warning(f"Sin área de staging en {staging} ({e}), los logs van directos a {target}")
+            self.staging = None
+
+    def stage(self, name):
+        if self.staging is None:
+            return os.path.join(self.target, name)
+        with self.lock:
+            self.staged[name] = (False, None)
+        return os.path.join(self.staging, name)
+
+    def commit(self, names):
+        # el escaneo terminó (bien o mal): lo escrito pasa a la SD ya
+        with self.lock:
+            for name in names:
+                if name in self.staged:
+                    self.staged[name] = (True, self.staged[name][1])
+        self.flush()
+
+    def start(self):
+        if self.staging is not None and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.flush()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error(f"Error copiando logs a {self.target}: {e}")
+
+    def flush(self):
+        with self.lock:
+            if self.staging is None or not self.staged:
+                return
+            os.makedirs(self.target, exist_ok=True)
+            written = []
+            for name, (finished, copied) in list(self.staged.items()):
+                source = os.path.join(self.staging, name)
+                try:
+                    st = os.stat(source)
+                except FileNotFoundError:
+                    del self.staged[name]
+                    continue
+                if (st.st_size, st.st_mtime_ns) != copied:
+                    self._copy(source, name)
+                    written.append(name)
+                if finished:
+                    os.unlink(source)
+                    del self.staged[name]
+                else:
+                    self.staged[name] = (False, (st.st_size, st.st_mtime_ns))
+            if written:
+                # un único fsync del directorio para todos los rename del lote
+                fd = os.open(self.target, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def _copy(self, source, name):
+        partial = os.path.join(self.target, f".{name}{STAGING_PARTIAL}")
+        with open(source, "rb") as src, open(partial, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(partial, os.path.join(self.target, name))
+
+    def recover(self):
+        # al arrancar: lo que siga en RAM (reinicio sin apagar) se copia entero; una copia a medias en la SD
+        # solo se conserva si no queda otra versión del log
+        recovered = []
+        if self.staging is not None:
+            with self.lock:
+                for entry in os.scandir(self.staging):
+                    if entry.is_dir():
+                        # temporales de nmap de un escaneo cortado
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        continue
+                    self.staged.setdefault(entry.name, (True, None))
+                    recovered.append(entry.name)
+        if os.path.isdir(self.target):
+            for entry in os.listdir(self.target):
+                if not (entry.startswith(".") and entry.endswith(STAGING_PARTIAL)):
+                    continue
+                name = entry[1:-len(STAGING_PARTIAL)]
+                partial = os.path.join(self.target, entry)
+                if name in recovered or os.path.exists(os.path.join(self.target, name)):
+                    os.unlink(partial)
+                else:
+                    logging.warning(f"Copia interrumpida de {name}: se conserva lo que llegó a la SD")
+                    os.replace(partial, os.path.join(self.target, name))
+        if recovered:
+            logging.info(f"Recuperando {len(recovered)} logs del área de staging")
+        self.flush()
 
-READY = 0
 
 class ScannerPlugin(plugins.Plugin):
     __author__ = '@jorge'
     __version__ = '2.1'
     __license__ = 'GPL3'
-    __description__ = 'Muestra un mensaje en pantalla y escanea redes abiertas o conocidas con wlan1'
-
-    load_ssid_data()
+    __description__ = 'Muestra un mensaje en pantalla y escanea redes abiertas o conocidas con uno o varios adaptadores wifi'
 
     def __init__(self):
         self.message = "  NMAP Plugin"
-        self.scanned_ssids = set()
         self.lock = threading.Lock()
-        self.scanning = False
+        self.agent = None
+        # cola acotada compartida: el callback solo encola, cada interfaz tiene su worker
+        # que conecta, escanea y desconecta; pending evita que dos interfaces tomen el mismo SSID
+        self.jobs = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+        self.pending = set()
+        self.interfaces = SCAN_INTERFACES
+        self.workers = {}
+        self.busy = set()
+        # avance del escaneo en curso por interfaz, para hello_status
+        self.progress = {}
+        self.display = DisplayCoalescer(self._refresh_view)
+        self.maintainer = None
+        self.stager = None
+        self.scheduler = None
+        self.selector = None
+        self.lists = None
+        self.signal = SignalTracker()
+        self.rssi_floor = RSSI_FLOOR
+        self.max_dwell = MAX_DWELL
+        self.supplicants = {}
+        self.leases = LeaseCache(LEASES_DIR)
+        self.iface = IfaceControl()
+        self.store = None
+        self.options = {}
+        self.assoc_timeout = ASSOC_TIMEOUT
+        self.max_targets = MAX_TARGETS
+        self.max_workers = None
+        self.memory_budget = MEMORY_BUDGET
 
     def on_loaded(self):
         global READY
         logging.info("HelloWorldScannerPlugin cargado")
+        self.assoc_timeout = float(self.options.get("assoc_timeout", ASSOC_TIMEOUT))
+        self.iface = IfaceControl(use_netlink=self.options.get("netlink", True))
+        self.max_targets = int(self.options.get("max_targets", MAX_TARGETS))
+        self.max_workers = self.options.get("max_workers")
+        self.store = ScanStore(SCAN_DB)
+        self.memory_budget = float(self.options.get("memory_budget", MEMORY_BUDGET))
+        self.scheduler = ScanScheduler(
+            SCHEDULE_FILE,
+            ttl=float(self.options.get("rescan_hours", RESCAN_HOURS)) * 3600,
+            backoff_base=float(self.options.get("backoff_base", BACKOFF_BASE)),
+            backoff_max=float(self.options.get("backoff_max", BACKOFF_MAX)),
+            max_entries=int(self.options.get("schedule_max_entries", SCHEDULE_MAX_ENTRIES)),
+        )
+        self.selector = CandidateSelector(self.scheduler)
+        ensure_ssid_files()
+        self.lists = SsidLists(NOSCAN_FILE, KNOWN_FILE)
+        self.rssi_floor = float(self.options.get("rssi_floor", RSSI_FLOOR))
+        self.max_dwell = float(self.options.get("max_dwell", MAX_DWELL))
+        self.interfaces = self.options.get("interfaces", SCAN_INTERFACES)
+        self.display.min_interval = float(self.options.get("display_interval", DISPLAY_MIN_INTERVAL))
+        self.maintainer = LogMaintainer(
+            SCAN_DIR,
+            compress_hours=float(self.options.get("log_compress_hours", LOG_COMPRESS_HOURS)),
+            max_files=int(self.options.get("log_max_files", LOG_MAX_FILES)),
+            max_days=float(self.options.get("log_max_days", LOG_MAX_DAYS)),
+            quota_mb=float(self.options.get("log_quota_mb", LOG_QUOTA_MB)),
+        )
+        self.maintainer.start()
+        self.stager = LogStager(SCAN_DIR, STAGING_DIR)
+        try:
+            self.stager.recover()
+        except OSError as e:
+            logging.error(f"Error recuperando el área de staging: {e}")
+        self.stager.start()
         READY = 1
 
+    def _enqueue(self, job):
+        with self.lock:
+            if job.ssid in self.pending:
+                return False
+            try:
+                self.jobs.put_nowait(job)
+            except queue.Full:
+                return False
+            self.pending.add(job.ssid)
+        return True
+
+    def _replace_jobs(self, candidates):
+        # la clasificación de este callback sustituye a la encolada: un trabajo de hace minutos (BSSID
+        # viejo, AP quizá fuera de rango) no debe pasar por delante de una red mejor vista ahora
+        with self.lock:
+            while True:
+                try:
+                    stale = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                self.pending.discard(stale.ssid)
+            for job in candidates:
+                if job.ssid in self.pending:
+                    # ya en curso en otra interfaz
+                    continue
+                try:
+                    self.jobs.put_nowait(job)
+                except queue.Full:
+                    break
+                self.pending.add(job.ssid)
+
+    def _available_interfaces(self):
+        if self.interfaces == "auto":
+            return wifi_interfaces()
+        return [name for name in self.interfaces if self._interface_exists(name)]
+
+    def _sync_workers(self, available):
+        with self.lock:
+            for interface in available:
+                worker = self.workers.get(interface)
+                if worker is None or not worker.is_alive():
+                    logging.info(f"Iniciando worker de escaneo en {interface}")
+                    worker = threading.Thread(target=self._scan_worker, args=(interface,), daemon=True)
+                    self.workers[interface] = worker
+                    worker.start()
+            for interface in list(self.workers):
+                if interface not in available:
+                    # el worker termina solo al ver que ya no está registrado
+                    del self.workers[interface]
+
+    def _scan_worker(self, interface):
+        while self.workers.get(interface) is threading.current_thread():
+            try:
+                job = self.jobs.get(timeout=1)
+            except queue.Empty:
+                continue
+            if not self._interface_exists(interface):
+                # el adaptador desapareció: devuelve el trabajo para otra interfaz y se da de baja
+                # para que _sync_workers arranque otro si vuelve (un USB que se reinicia)
+                with self.lock:
+                    self.pending.discard(job.ssid)
+                    if self.workers.get(interface) is threading.current_thread():
+                        del self.workers[interface]
+                self._enqueue(job)
+                break
+            success = False
+            try:
+                success = self._connect_and_scan(job, interface)
+            except Exception as e:
+                logging.error(f"Error en el worker de escaneo de {interface} ({job.ssid}): {e}")
+            finally:
+                if success is not None:
+                    self.scheduler.record(job.ssid, success)
+                with self.lock:
+                    self.pending.discard(job.ssid)
+        logging.info(f"Worker de escaneo de {interface} detenido")
+
+    def _stop_workers(self):
+        with self.lock:
+            self.workers.clear()
+        while True:
+            try:
+                self.jobs.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.pending.clear()
+
+    def _refresh_view(self):
+        if self.agent is not None:
+            self.agent.view().update(force=True)
+
+    def _show(self, text):
+        self.message = text
+        self.display.post(text)
+
     def _interface_exists(self, interface):
-        return os.path.exists(f'/sys/class/net/{interface}')
+        return self.iface.exists(interface)
+
+    def _supplicant(self, interface):
+        with self.lock:
+            if interface not in self.supplicants:
+                self.supplicants[interface] = Supplicant(interface)
+            return self.supplicants[interface]
+
+    def _lease_file(self, interface):
+        return f"/tmp/auto_nmap_{interface}.leases"
+
+    def _dhclient(self, interface, *args):
+        return ["dhclient", *args, "-lf", self._lease_file(interface),
+                "-pf", f"/run/auto_nmap_dhclient_{interface}.pid", interface]
+
+    def _dhcp(self, interface, ssid, bssid):
+        # con un lease en cache dhclient hace INIT-REBOOT; si el servidor lo rechaza, intercambio completo
+        lease = self.leases.lookup(ssid, bssid)
+        lease_file = self._lease_file(interface)
+        with open(lease_file, "w") as f:
+            if lease:
+                f.write(re.sub(r'interface "[^"]*";', f'interface "{interface}";', lease) + "\n")
+        started = time.monotonic()
+        subprocess.run(self._dhclient(interface, "-1"), check=True)
+        elapsed = time.monotonic() - started
+        current = self.leases.store(ssid, bssid, lease_file)
+        # solo es acierto si el servidor aceptó el INIT-REBOOT; tras un NAK hay intercambio completo
+        # y normalmente otra dirección
+        cached = LeaseCache.address(lease)
+        hit = cached is not None and LeaseCache.address(current) == cached
+        self.leases.record(hit, elapsed)
+        stats = self.leases.stats()
+        if hit:
+            cache = "(lease en cache)"
+        else:
+            cache = "(lease en cache rechazado)" if lease else "(sin cache)"
+        logging.info(
+            f"DHCP en {interface}: {elapsed:.1f}s {cache} "
+            f"hits={stats['hits']} misses={stats['misses']} ahorro={stats['saved']:.1f}s"
+        )
 
-    def _connect_to_open_network(self, ssid, interface="wlan1"):
-        if ssid in SSID_NOSCAN:
+    def _connect_to_open_network(self, ssid, interface, bssid=None):
+        if ssid in self.lists.noscan:
             return False
 
         logging.info(f"Intentando conectarse a la red abierta SSID: {ssid}")
-        config = f"""
-        network={{
-            ssid=\"{ssid}\"
-            key_mgmt=NONE
-        }}
-        """
-        with open("/tmp/open.conf", "w") as f:
-            f.write(config)
-
         try:
-            subprocess.run(["wpa_supplicant", "-B", "-i", interface, "-c", "/tmp/open.conf"], check=True)
-            time.sleep(5)
-            subprocess.run(["dhclient", interface], check=True)
+            if not self._supplicant(interface).connect(ssid, None, self.assoc_timeout):
+                return False
+            self._dhcp(interface, ssid, bssid)
             logging.info(f"Conectado a {ssid} en {interface}")
             return True
-        except subprocess.CalledProcessError as e:
+        except (OSError, subprocess.CalledProcessError) as e:
             logging.error(f"Error al conectar a {ssid}: {e}")
             return False
 
-    def _connect_to_known_network(self, ssid, password, interface="wlan1"):
+    def _connect_to_known_network(self, ssid, password, interface, bssid=None):
         logging.info(f"Intentando conectarse a red conocida SSID: {ssid}")
-        config = f"""
-        network={{
-            ssid=\"{ssid}\"
-            psk=\"{password}\"
-        }}
-        """
-        with open("/tmp/known.conf", "w") as f:
-            f.write(config)
-
         try:
-            subprocess.run(["wpa_supplicant", "-B", "-i", interface, "-c", "/tmp/known.conf"], check=True)
-            time.sleep(5)
-            subprocess.run(["dhclient", interface], check=True)
+            if not self._supplicant(interface).connect(ssid, password, self.assoc_timeout):
+                return False
+            self._dhcp(interface, ssid, bssid)
             logging.info(f"Conectado a red conocida {ssid}")
             return True
-        except subprocess.CalledProcessError as e:
+        except (OSError, subprocess.CalledProcessError) as e:
             logging.error(f"Error al conectar a red conocida {ssid}: {e}")
             return False
 
-    def _disconnect(self, interface="wlan1"):
+    def _disconnect(self, interface):
         logging.info(f"Desconectando {interface}")
-        subprocess.run(["dhclient", "-r", interface], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["pkill", "-f", f"wpa_supplicant.*{interface}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["ip", "link", "set", interface, "down"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(1)
-        subprocess.run(["ip", "link", "set", interface, "up"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # -x detiene dhclient sin RELEASE: el servidor conserva la asignación para el INIT-REBOOT
+        subprocess.run(self._dhclient(interface, "-x"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self._supplicant(interface).disconnect()
+            self.iface.flush_addresses(interface)
+            if not self.iface.link(interface)["up"]:
+                self.iface.set_link(interface, True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.error(f"Error desconectando {interface}: {e}")
+
+    def _discover_hosts(self, targets, own_ip, gateway, interface, budget):
+        # fase 1: barrido ARP/ping, sin puertos; como mucho un tercio del presupuesto
+        timeout = max(5.0, (budget.deadline - time.monotonic()) / 3)
+        try:
+            output = subprocess.run(
+                ["nmap", "-e", interface, "-sn", "-n", "-T4", "--exclude", own_ip, "-iL", "-", "-oX", "-"],
+                input="\n".join(targets), capture_output=True, text=True, check=True, timeout=timeout,
+            ).stdout
+        except subprocess.TimeoutExpired as e:
+            logging.warning(f"Descubrimiento cortado a los {timeout:.0f}s, se usan los hosts encontrados")
+            if interface in self.progress:
+                self.progress[interface].truncated = True
+            output = e.stdout or ""
+            if isinstance(output, bytes):
+                output = output.decode(errors="replace")
+        hosts = [host for host in NmapXmlStream().feed(output) if host["status"] == "up" and host["ip"]]
+        hosts.sort(key=lambda host: (host["ip"] != gateway, ipaddress.ip_address(host["ip"])))
+        return hosts
 
-    def _run_nmap_scan(self, interface="wlan1", ssid="unknown"):
+    def _scan_shard(self, hosts, output_file, scan_id, nmap_args, deadline, progress, log=None):
+        if deadline - time.monotonic() <= 0:
+            raise TimeoutError("presupuesto de escaneo agotado")
+        # -oX - por stdout: cada host se guarda en cuanto nmap lo termina, y --stats-every da el avance
+        proc = subprocess.Popen(["nmap", *nmap_args, "--stats-every", "5s", "-oN", output_file, "-oX", "-", "-iL", "-"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        stream = NmapXmlStream()
+        normal = NormalOutputTail(output_file)
+        done = found = 0
         try:
-            ip_output = subprocess.check_output(["ip", "addr", "show", interface]).decode()
-            ip_line = [line.strip() for line in ip_output.splitlines() if "inet " in line]
-            if not ip_line:
+            proc.stdin.write("\n".join(hosts).encode())
+            proc.stdin.close()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # lo ya guardado es un resultado parcial válido
+                    logging.warning(f"Plazo agotado en un shard de {len(hosts)} hosts, se guardan resultados parciales")
+                    progress.truncated = True
+                    break
+                if not select.select([proc.stdout], [], [], min(remaining, 1.0))[0]:
+                    continue
+                data = os.read(proc.stdout.fileno(), 64 * 1024)
+                if not data:
+                    break
+                completed = stream.feed(data)
+                if completed:
+                    self.store.add_hosts(scan_id, completed)
+                    if log is not None:
+                        # nmap escribe el bloque -oN de un host antes de cerrar su <host> en el XML
+                        log.write(normal.read())
+                    done += len(completed)
+                    found += sum(1 for host in completed if host["ports"])
+                percent = stream.progress[1] if stream.progress else 0.0
+                progress.update(output_file, len(hosts), done, found, percent)
+                self.message = progress.label()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            if log is not None:
+                log.write(normal.read())
+            normal.close()
+        if proc.returncode not in (0, -9):
+            raise subprocess.CalledProcessError(proc.returncode, "nmap")
+        if not os.path.exists(output_file):
+            return ""
+        with open(output_file) as f:
+            return f.read()
+
+    def _scan_ports(self, live, scan_id, interface, budget, nmap_args=None, log=None):
+        # -e: con varias interfaces conectadas, cada nmap sale por la suya
+        nmap_args = ["-e", interface, *(nmap_args or budget.args), "--host-timeout", f"{budget.host_timeout}s"]
+        workers = scan_workers(live, self.max_workers, self.memory_budget)
+        # reparto intercalado para que cada shard tenga un número parecido de hosts
+        shards = [live[i::workers] for i in range(workers)]
+        logging.info(f"Escaneando puertos de {len(live)} hosts en {workers} procesos nmap ({' '.join(nmap_args)})")
+        progress = self.progress.get(interface) or ScanProgress("unknown")
+        if log is not None:
+            log.write(f"# nmap {' '.join(nmap_args)} ({len(live)} hosts, {workers} procesos)\n\n")
+        outputs = []
+        with tempfile.TemporaryDirectory(prefix="auto_nmap_", dir=self.stager.staging) as tmp:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(self._scan_shard, shard, os.path.join(tmp, f"shard_{i}.nmap"), scan_id, nmap_args,
+                                budget.deadline, progress, log)
+                    for i, shard in enumerate(shards)
+                ]
+                errors = []
+                for future in futures:
+                    try:
+                        outputs.append(future.result())
+                    except (OSError, subprocess.CalledProcessError, ET.ParseError, sqlite3.Error) as e:
+                        logging.error(f"Error en un shard de nmap: {e}")
+                        errors.append(e)
+        if errors:
+            progress.truncated = True
+        if not outputs:
+            raise errors[0]
+        return outputs
+
+    def _scan_delta(self, discovered, previous, scan_id, interface, budget, log=None):
+        # revisita: confirma los puertos ya conocidos y reserva el escaneo completo para lo nuevo o cambiado
+        known = [
+            host["ip"] for host in discovered
+            if host["ip"] in previous["hosts"] and same_mac(previous["hosts"][host["ip"]]["mac"], host["mac"])
+        ]
+        deep = [host["ip"] for host in discovered if host["ip"] not in known]
+        confirm = [ip for ip in known if previous["hosts"][ip]["ports"]]
+        outputs = []
+        if confirm:
+            ports = sorted({port for ip in confirm for port, _ in previous["hosts"][ip]["ports"]})
+            outputs += self._scan_ports(confirm, scan_id, interface, budget, ["-T4", "-p", ",".join(map(str, ports))],
+                                        log)
+            current = self.store.open_ports(scan_id)
+            deep += [ip for ip in confirm if current.get(ip, set()) != previous["hosts"][ip]["ports"]]
+        logging.info(f"Revisita: {len(known)} hosts conocidos, {len(deep)} para escaneo completo")
+        if deep:
+            if budget.deadline > time.monotonic():
+                outputs += self._scan_ports(deep, scan_id, interface, budget, log=log)
+            elif interface in self.progress:
+                self.progress[interface].truncated = True
+        return outputs
+
+    def _run_nmap_scan(self, interface, ssid="unknown", bssid=None):
+        staged = []
+        try:
+            if not self.iface.link(interface)["carrier"]:
+                logging.warning(f"{interface} sin portadora, se cancela el escaneo")
+                return False
+            addresses = self.iface.addresses(interface)
+            if not addresses:
                 logging.warning(f"No se pudo obtener IP en {interface}")
                 return False
-            ip = ip_line[0].split()[1]
-            subnet = ip.split('/')[1]
-            network = ip.split('/')[0].rsplit('.', 1)[0] + ".0/" + subnet
+            own_ip = addresses[0].split("/")[0]
+            gateway = self.iface.gateway(interface)
+            network, targets = plan_targets(addresses[0], gateway, self.max_targets)
 
-            logging.info(f"Escaneando la red: {network}")
+            budget = plan_budget(self.signal.time_in_range(ssid, self.rssi_floor, self.max_dwell))
+            logging.info(f"Escaneando la red: {network} ({len(targets)} objetivos, gateway {gateway}), "
+                         f"presupuesto {budget.seconds:.0f}s: {' '.join(budget.args)}")
+            self.progress[interface] = ScanProgress(ssid)
+            discovered = self._discover_hosts(targets, own_ip, gateway, interface, budget)
+            live = [host["ip"] for host in discovered]
+            logging.info(f"{len(live)} hosts activos en {network}")
 
-            os.makedirs("/home/pi/auto_nmap", exist_ok=True)
+            os.makedirs(SCAN_DIR, exist_ok=True)
             fecha = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
             ssid_safe = ssid.replace(" ", "_").replace("/", "_")
-            log_file = f"/home/pi/auto_nmap/nmap_scan_{ssid_safe}_{fecha}.log"
+            log_name = f"nmap_scan_{ssid_safe}_{fecha}.log"
+            log_file = os.path.join(SCAN_DIR, log_name)
 
-            with open(log_file, "w") as f:
-                subprocess.run(["nmap", "-T4", "-F", network], stdout=f, stderr=subprocess.STDOUT, check=True)
+            gateway_mac = next((host["mac"] for host in discovered if host["ip"] == gateway), None)
+            key = network_key(ssid, gateway_mac)
+            previous = self.store.fingerprint(key)
+            scan_id = self.store.begin_scan(ssid, bssid, network, gateway, log_file, key)
+            self.store.add_hosts(scan_id, discovered)
+            staged.append(log_name)
+            with open(self.stager.stage(log_name), "w") as f:
+                log = ScanLog(f)
+                log.write(f"# Red: {network}  gateway: {gateway or '-'}  hosts activos: {len(live)}\n")
+                if live:
+                    # fase 2: puertos solo en los hosts que respondieron; cada host se añade al log al terminar
+                    log.write(f"# Hosts: {' '.join(live)}\n\n")
+                    # copia inmediata a SCAN_DIR: el log aparece en /list desde el principio del escaneo
+                    self.stager.flush()
+                    if previous:
+                        outputs = self._scan_delta(discovered, previous, scan_id, interface, budget, log)
+                    else:
+                        outputs = self._scan_ports(live, scan_id, interface, budget, log=log)
+                    if outputs:
+                        log.write(nmap_done_line(outputs))
+            self.store.finish_scan(scan_id, not self.progress[interface].truncated, " ".join(budget.args))
+
+            if previous:
+                delta_name = log_name[:-len(".log")] + "_delta.log"
+                staged.append(delta_name)
+                with open(self.stager.stage(delta_name), "w") as f:
+                    f.write(delta_report(ssid, previous, discovered, self.store.open_ports(scan_id)))
+                logging.info(f"Delta guardado en {os.path.join(SCAN_DIR, delta_name)}")
 
             logging.info(f"Escaneo guardado en {log_file}")
             return True
         except Exception as e:
             logging.error(f"Error ejecutando nmap: {e}")
             return False
+        finally:
+            self.progress.pop(interface, None)
+            if staged:
+                # también si el escaneo falló: lo que llegó a escribirse es un resultado parcial
+                try:
+                    self.stager.commit(staged)
+                except OSError as e:
+                    logging.error(f"Error copiando {', '.join(staged)} a {SCAN_DIR}: {e}")
 
-    def _connect_and_scan(self, ssid, password, agent, is_known):
+    def _connect_and_scan(self, job, interface):
+        ssid = job.ssid
         with self.lock:
-            if self.scanning:
-                return
-            self.scanning = True
+            if interface in self.busy or not self.scheduler.due(ssid):
+                return None
+            self.busy.add(interface)
 
         try:
-            self.message = f"[~]:{ssid[:14]}"
-            agent.view().update(force=True)
-            success = self._run_nmap_scan(ssid=ssid)
-            if success:
-                self.scanned_ssids.add(ssid)
-                self.message = f"[O]:{ssid[:14]}"
+            if job.password is not None:
+                connected = self._connect_to_known_network(ssid, job.password, interface, job.bssid)
             else:
-                self.message = f"[X]:{ssid[:14]}"
-            agent.view().update(force=True)
+                connected = self._connect_to_open_network(ssid, interface, job.bssid)
+            if not connected:
+                self._show(f"[X]:{ssid[:14]}")
+                return False
+
+            self._show(f"[~]:{ssid[:14]}")
+            success = self._run_nmap_scan(interface, ssid, job.bssid)
+            self._show(f"[O]:{ssid[:14]}" if success else f"[X]:{ssid[:14]}")
+            return success
         finally:
-            self._disconnect()
+            self._disconnect(interface)
             with self.lock:
-                self.scanning = False
+                self.busy.discard(interface)
 
     def on_unfiltered_ap_list(self, agent, access_points):
         global READY
@@ -181,60 +1846,32 @@ class ScannerPlugin(plugins.Plugin):
         if not hasattr(self, "wlan_missing"):
             self.wlan_missing = False
 
-        if not self._interface_exists("wlan1"):
+        available = self._available_interfaces()
+        self._sync_workers(available)
+        if not available:
             if not self.wlan_missing:
-                logging.warning("¡El adaptador wlan1 ha sido desconectado!")
+                logging.warning("¡No hay adaptadores de escaneo conectados!")
                 self.message = "  wifi: False"
                 self.wlan_missing = True
             return
         else:
             if self.wlan_missing:
-                logging.info("El adaptador wlan1 ha sido reconectado.")
+                logging.info(f"Adaptadores de escaneo disponibles: {', '.join(available)}")
                 self.message = "  wifi: True"
                 self.wlan_missing = False
 
-        if self.scanning:
-            return
-
-        for ssid, password in SSID_KNOWN.items():
-            if ssid in self.scanned_ssids:
-                continue
-            matching_aps = [ap for ap in access_points if (ap.get("hostname") or ap.get("ssid")) == ssid]
-            if not matching_aps:
-                continue
-            if self._connect_to_known_network(ssid, password):
-                threading.Thread(target=self._connect_and_scan, args=(ssid, password, agent, True)).start()
-                return
-
-        open_networks = [
-            ap for ap in access_points
-            if ap.get("encryption", "unknown").lower() in ["open", "none"]
-        ]
+        self.agent = agent
+        # muestras de RSSI y clasificación en cada callback, aunque los workers sigan ocupados
+        self.lists.refresh()
+        index = self.selector.index(access_points)
+        self.signal.observe(index)
 
-        new_networks = [
-            ap for ap in open_networks
-            if (ap.get("hostname") or ap.get("ssid")) not in self.scanned_ssids
-        ]
-
-        if not new_networks:
-            logging.info("Todas las redes ya fueron escaneadas en esta sesión.")
-            self.message = "  Buscando..."
-            return
-
-        for ap in new_networks:
-            ssid = ap.get("hostname") or ap.get("ssid")
-
-            if ssid in SSID_NOSCAN:
-                logging.info(f"Descartando red abierta: {ssid}")
+        candidates = self.selector.rank(index, self.lists.known, self.lists.noscan)
+        self._replace_jobs(candidates)
+        if not candidates:
+            logging.info("No hay redes pendientes de escanear.")
+            if not self.busy:
                 self.message = "  Buscando..."
-                continue
-
-            if not ssid or ssid in self.scanned_ssids or ssid in SSID_NOSCAN:
-                continue
-
-            if self._connect_to_open_network(ssid):
-                threading.Thread(target=self._connect_and_scan, args=(ssid, None, agent, False)).start()
-                break
 
     def on_ui_setup(self, ui):
         if ui.is_waveshare_v2():
@@ -263,9 +1900,19 @@ class ScannerPlugin(plugins.Plugin):
         )
 
     def on_ui_update(self, ui):
+        message = self.message
         with ui._lock:
-            ui.set('hello_status', self.message)
+            ui.set('hello_status', message)
+        self.display.rendered(message)
 
     def on_unload(self, ui):
+        self.display.cancel()
+        if self.maintainer is not None:
+            self.maintainer.stop()
+        if self.stager is not None:
+            self.stager.stop()
+        self._stop_workers()
+        for supplicant in self.supplicants.values():
+            supplicant.terminate()
         with ui._lock:
             ui.remove_element('hello_status')
@@ -3,9 +3,12 @@ import os
 import subprocess
 import time
 import datetime
+import threading
+import queue
 import pwnagotchi.plugins as plugins
 
 READY = 0
+SCAN_QUEUE_SIZE = 4
 SSID_NOSCAN = ["SSID"]
 SSID_KNOWN = {
     "SSID": "PASSWORD",
@@ -20,12 +23,69 @@ class OpenNetworkScanner(plugins.Plugin):
 
     def __init__(self):
         self.scanned_ssids = set()
+        self.lock = threading.Lock()
+        # cola acotada: el callback solo encola, el worker conecta, escanea y desconecta
+        self.jobs = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+        self.pending = set()
+        self.worker = None
 
     def on_loaded(self):
         global READY
         logging.info("OpenNetworkScanner cargado")
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._scan_worker, daemon=True)
+            self.worker.start()
         READY = 1
 
+    def on_unload(self, ui):
+        while True:
+            try:
+                self.jobs.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.pending.clear()
+        self.jobs.put_nowait(None)
+        self.worker = None
+
+    def _enqueue(self, ssid, password, is_known):
+        with self.lock:
+            if ssid in self.pending:
+                return False
+            try:
+                self.jobs.put_nowait((ssid, password, is_known))
+            except queue.Full:
+                return False
+            self.pending.add(ssid)
+        return True
+
+    def _scan_worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            ssid, password, is_known = job
+            try:
+                self._connect_and_scan(ssid, password, is_known)
+            except Exception as e:
+                logging.error(f"Error en el worker de escaneo ({ssid}): {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(ssid)
+
+    def _connect_and_scan(self, ssid, password, is_known):
+        if ssid in self.scanned_ssids:
+            return
+        try:
+            if is_known:
+                connected = self._connect_to_known_network(ssid, password)
+            else:
+                connected = self._connect_to_open_network(ssid)
+            if connected and self._run_nmap_scan(ssid=ssid):
+                self.scanned_ssids.add(ssid)
+        finally:
+            self._disconnect()
+
     def _interface_exists(self, interface):
         return os.path.exists(f'/sys/class/net/{interface}')
 
@@ -129,21 +189,19 @@ class OpenNetworkScanner(plugins.Plugin):
                 logging.info("El adaptador wlan1 ha sido reconectado.")
                 self.wlan_missing = False
 
-        # Primero intenta redes conocidas (con contraseña)
+        if self.jobs.full():
+            return
+
+        # Primero encola redes conocidas (con contraseña)
         for ssid, password in SSID_KNOWN.items():
             if ssid in self.scanned_ssids:
                 continue
             matching_aps = [ap for ap in access_points if (ap.get("hostname") or ap.get("ssid")) == ssid]
             if not matching_aps:
                 continue
+            self._enqueue(ssid, password, True)
 
-            if self._connect_to_known_network(ssid, password):
-                if self._run_nmap_scan(ssid=ssid):
-                    self.scanned_ssids.add(ssid)
-                self._disconnect()
-                return  # solo una red por ciclo
-
-        # Luego escanea redes abiertas
+        # Luego encola redes abiertas
         open_networks = [
             ap for ap in access_points
             if ap.get("encryption", "unknown").lower() in ["open", "none"]
@@ -166,9 +224,6 @@ class OpenNetworkScanner(plugins.Plugin):
                 logging.info(f"Descartando red abierta: {ssid}")
                 continue
 
-            if self._connect_to_open_network(ssid):
-                if self._run_nmap_scan(ssid=ssid):
-                    self.scanned_ssids.add(ssid)
-                self._disconnect()
+            if not self._enqueue(ssid, None, False) and self.jobs.full():
                 break
 
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# Benchmarks sin Pi ni radios: los plugins reales contra pwnagotchi.* de stubs/ y
+# wpa_supplicant, dhclient, ip, pkill y nmap falsos de fakes/ con latencias configurables.
+#
+#   python3 benchmarks/run.py                      # compara con benchmarks/baseline.json
+#   python3 benchmarks/run.py --save-baseline      # guarda los resultados como nueva referencia
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+OUTPUT_FILE = os.path.join(REPO_DIR, "bench_output.txt")
+
+sys.path.insert(0, os.path.join(BENCH_DIR, "stubs"))
+sys.path.insert(0, REPO_DIR)
+os.environ["PATH"] = os.path.join(BENCH_DIR, "fakes") + os.pathsep + os.environ["PATH"]
+
+import auto_nmap  # noqa: E402
+import file_editor  # noqa: E402
+from pwnagotchi.ui.view import View  # noqa: E402
+
+SERVICES = [(22, "ssh", "OpenSSH 8.4p1"), (80, "http", "lighttpd 1.4.59"), (443, "https", "nginx"),
+            (445, "microsoft-ds", "Samba smbd 4"), (554, "rtsp", "Hikvision rtsp")]
+# métricas donde más es mejor; el resto son tiempos
+HIGHER_IS_BETTER = ("req_s",)
+# solo medianas y throughput deciden una regresión: p95 y máximos se muestran pero son demasiado ruidosos
+GATED = ("p50_ms", "p50_s", "req_s")
+# diferencias absolutas por debajo de esto son ruido del temporizador, sea cual sea el porcentaje
+NOISE_FLOOR = {"ms": 0.1, "s": 0.05}
+
+
+class Agent:
+    def __init__(self):
+        self._view = View()
+
+    def view(self):
+        return self._view
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def access_points(count, seed=0, open_ratio=0.3):
+    # misma forma que las entradas de bettercap que recibe on_unfiltered_ap_list
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    aps = []
+    for i in range(count):
+        seen = now - datetime.timedelta(seconds=rng.uniform(0, 300))
+        aps.append({
+            "hostname": f"bench-{seed}-{i}",
+            "mac": f"02:{seed % 256:02x}:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}:01",
+            "rssi": rng.randint(-90, -30),
+            "channel": rng.choice((1, 6, 11, 36, 44)),
+            "encryption": "OPEN" if rng.random() < open_ratio else "WPA2",
+            "last_seen": seen.strftime("%Y-%m-%dT%H:%M:%S.%f") + "123Z",
+        })
+    return aps
+
+
+def scan_log(n, hosts=12):
+    lines = [f"# Red: 10.{n % 250}.0.0/24  gateway: 10.{n % 250}.0.1  hosts activos: {hosts}\n"]
+    for h in range(hosts):
+        port, service, banner = SERVICES[(n + h) % len(SERVICES)]
+        lines.append(f"Nmap scan report for 10.{n % 250}.0.{h + 1}\nHost is up (0.0020s latency).\n"
+                     f"PORT   STATE SERVICE VERSION\n{port}/tcp open  {service} {banner}\n\n")
+    return "".join(lines)
+
+
+def setup(root):
+    # todas las rutas fijas de los plugins, dentro de root
+    files_dir = os.path.join(root, "files_nmap")
+    state_dir = os.path.join(root, "state")
+    auto_nmap.FILES_DIR = files_dir
+    auto_nmap.SCAN_DIR = os.path.join(root, "auto_nmap")
+    auto_nmap.NOSCAN_FILE = os.path.join(files_dir, "ssid_noscan.txt")
+    auto_nmap.KNOWN_FILE = os.path.join(files_dir, "ssid_known.json")
+    auto_nmap.STATE_DIR = state_dir
+    auto_nmap.LEASES_DIR = os.path.join(state_dir, "leases")
+    auto_nmap.SCAN_DB = os.path.join(state_dir, "scans.db")
+    auto_nmap.SCHEDULE_FILE = os.path.join(state_dir, "schedule.json")
+    auto_nmap.WPA_CTRL_DIR = os.path.join(root, "wpa")
+    auto_nmap.STAGING_DIR = os.path.join(root, "shm")
+    auto_nmap.MIN_BUDGET = 1
+    file_editor.STAGING_DIR = auto_nmap.STAGING_DIR
+    file_editor.SEARCH_DB = os.path.join(state_dir, "search.db")
+    file_editor.SCAN_DB = auto_nmap.SCAN_DB
+    for path in (files_dir, auto_nmap.SCAN_DIR, state_dir, auto_nmap.WPA_CTRL_DIR):
+        os.makedirs(path, exist_ok=True)
+
+
+def make_scanner(rescan_hours=24):
+    plugin = auto_nmap.ScannerPlugin()
+    plugin.options = {"netlink": False, "interfaces": ["wlan1"], "rescan_hours": rescan_hours,
+                      "display_interval": 0}
+    plugin._interface_exists = lambda interface: True
+    plugin.leases = auto_nmap.LeaseCache(auto_nmap.LEASES_DIR)
+    plugin.on_loaded()
+    return plugin
+
+
+def bench_callback(plugin, counts, iterations):
+    # solo el callback: sin workers, la cola se vacía entre llamadas para que cada una haga el trabajo completo
+    plugin._sync_workers = lambda available: None
+    agent = Agent()
+    results = {}
+    for count in counts:
+        aps = access_points(count, seed=count)
+        runs = max(20, iterations * 100 // max(count, 100))
+        # la primera llamada con un tamaño nuevo paga cachés y memoria: no cuenta
+        plugin.on_unfiltered_ap_list(agent, aps)
+        samples = []
+        for _ in range(runs):
+            plugin._stop_workers()
+            started = time.perf_counter()
+            plugin.on_unfiltered_ap_list(agent, aps)
+            samples.append((time.perf_counter() - started) * 1000)
+        plugin._stop_workers()
+        results[str(count)] = {"p50_ms": statistics.median(samples), "p95_ms": percentile(samples, 0.95),
+                               "runs": runs}
+        logging.info(f"callback {count} APs: p50 {results[str(count)]['p50_ms']:.2f} ms")
+    return results
+
+
+def wait_idle(plugin, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with plugin.lock:
+            if not plugin.pending and not plugin.busy and plugin.jobs.empty():
+                return True
+        time.sleep(0.005)
+    return False
+
+
+def bench_cycles(plugin, cycles, background, timeout):
+    # ciclo completo por red abierta: asociación, DHCP, descubrimiento, puertos, SQLite y logs;
+    # la segunda pasada vuelve a las mismas redes (lease en cache y escaneo delta)
+    agent = Agent()
+    noise = [dict(ap, encryption="WPA2") for ap in access_points(background, seed=7)]
+    results = {}
+    for label in ("first", "revisit"):
+        samples = []
+        for i in range(cycles):
+            target = dict(access_points(1, seed=1000 + i)[0], encryption="OPEN", rssi=-40)
+            started = time.perf_counter()
+            plugin.on_unfiltered_ap_list(agent, noise + [target])
+            if not wait_idle(plugin, timeout):
+                raise RuntimeError(f"el ciclo {label} {i} no terminó en {timeout}s")
+            samples.append(time.perf_counter() - started)
+        results[label] = {"p50_s": statistics.median(samples), "max_s": max(samples), "runs": cycles}
+        logging.info(f"ciclo {label}: p50 {results[label]['p50_s']:.2f} s")
+    return results
+
+
+def bench_web(plugin, scan_dir, logs, seconds):
+    for n in range(logs):
+        path = os.path.join(scan_dir, f"nmap_scan_bench-{n}_2025-01-{n % 28 + 1:02d}_12-00-{n % 60:02d}.log")
+        with open(path, "w") as f:
+            f.write(scan_log(n))
+        mtime = time.time() - n * 3600
+        os.utime(path, (mtime, mtime))
+    name = sorted(os.listdir(scan_dir))[0]
+    endpoints = {
+        "list": "/list/auto_nmap",
+        "list_sorted": "/list/auto_nmap?sort=mtime&page=2",
+        "view": f"/view/auto_nmap/{name}",
+        "download": f"/download/auto_nmap/{name}",
+        "search": "/search?q=445+ssh",
+        "api_scans": "/api/scans?limit=100",
+    }
+    client = plugin.app.test_client()
+    results = {}
+    for key, url in endpoints.items():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: HTTP {response.status_code}")
+        requests = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            client.get(url).close()
+            requests += 1
+        results[key] = {"req_s": requests / (time.perf_counter() - started)}
+        logging.info(f"web {url}: {results[key]['req_s']:.0f} req/s")
+    return results
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif key != "runs":
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(current, baseline, tolerance):
+    lines, regressions = [], []
+    for key, value in sorted(flatten(current).items()):
+        reference = flatten(baseline).get(key)
+        if not reference:
+            lines.append(f"{key:<40} {value:>12.3f}")
+            continue
+        change = (value - reference) / reference
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        floor = NOISE_FLOOR.get(key.rsplit("_", 1)[-1], 0)
+        mark = ""
+        if not key.endswith(GATED):
+            mark = "  (info)"
+        elif worse > tolerance and abs(value - reference) > floor:
+            mark = "  REGRESIÓN"
+            regressions.append(key)
+        lines.append(f"{key:<40} {value:>12.3f} {reference:>12.3f} {change:>+8.0%}{mark}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de auto_nmap y file_editor con herramientas falsas")
+    parser.add_argument("--aps", default="10,100,1000,10000", help="tamaños de access_points para el callback")
+    parser.add_argument("--iterations", type=int, default=200, help="llamadas al callback con 100 APs o menos")
+    parser.add_argument("--cycles", type=int, default=5, help="ciclos conectar-escanear por pasada")
+    parser.add_argument("--background", type=int, default=200, help="APs cifrados alrededor en cada ciclo")
+    parser.add_argument("--logs", type=int, default=500, help="logs sintéticos para los endpoints web")
+    parser.add_argument("--web-seconds", type=float, default=1.0, help="segundos por endpoint")
+    parser.add_argument("--assoc-delay", type=float, default=0.1)
+    parser.add_argument("--dhcp-delay", type=float, default=0.3)
+    parser.add_argument("--dhcp-reboot-delay", type=float, default=0.05)
+    parser.add_argument("--ip-delay", type=float, default=0.005)
+    parser.add_argument("--nmap-hosts", type=int, default=8)
+    parser.add_argument("--nmap-discovery-delay", type=float, default=0.2)
+    parser.add_argument("--nmap-host-delay", type=float, default=0.05)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="empeoramiento admitido antes de fallar")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL, format="%(message)s")
+
+    os.environ.update({
+        "FAKE_ASSOC_DELAY": str(args.assoc_delay),
+        "FAKE_DHCP_DELAY": str(args.dhcp_delay),
+        "FAKE_DHCP_REBOOT_DELAY": str(args.dhcp_reboot_delay),
+        "FAKE_IP_DELAY": str(args.ip_delay),
+        "FAKE_NMAP_HOSTS": str(args.nmap_hosts),
+        "FAKE_NMAP_DISCOVERY_DELAY": str(args.nmap_discovery_delay),
+        "FAKE_NMAP_HOST_DELAY": str(args.nmap_host_delay),
+        "FAKE_WPA_IDLE_TIMEOUT": "120",
+    })
+    root = tempfile.mkdtemp(prefix="auto_nmap_bench_")
+    setup(root)
+    scanner = None
+    try:
+        results = {}
+        scanner = make_scanner()
+        results["callback"] = bench_callback(scanner, [int(n) for n in args.aps.split(",")], args.iterations)
+        scanner.on_unload(View())
+        scanner = make_scanner(rescan_hours=0)
+        timeout = 30 + 10 * (args.assoc_delay + args.dhcp_delay + args.nmap_discovery_delay
+                             + args.nmap_hosts * args.nmap_host_delay)
+        results["cycle"] = bench_cycles(scanner, args.cycles, args.background, timeout)
+
+        web = file_editor.FileWebServerPlugin()
+        web.directories = {
+            "files_nmap": auto_nmap.FILES_DIR,
+            "auto_nmap": auto_nmap.SCAN_DIR,
+            "handshakes": os.path.join(root, "handshakes"),
+        }
+        os.makedirs(web.directories["handshakes"], exist_ok=True)
+        results["web"] = bench_web(web, auto_nmap.SCAN_DIR, args.logs, args.web_seconds)
+    finally:
+        if scanner is not None:
+            scanner.on_unload(View())
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ("baseline", "save_baseline", "output", "verbose")}
+    if baseline and baseline.get("args") != settings:
+        print("Aviso: la referencia se midió con otros parámetros, la comparación no es fiable")
+    lines, regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    header = f"{'métrica':<40} {'actual':>12} {'referencia':>12} {'cambio':>8}"
+    report = "\n".join([header, *lines, ""])
+    print(report, end="")
+    with open(args.output, "w") as f:
+        f.write(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            # con qué latencias y tamaños se midió, para repetirlo igual
+            json.dump({"args": settings, "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Referencia guardada en {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} métricas empeoran más de un {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# pwnagotchi mínimo para cargar los plugins fuera de la Raspberry Pi
@@ -0,0 +1,2 @@
+class Plugin:
+    options = {}
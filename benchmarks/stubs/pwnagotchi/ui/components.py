@@ -0,0 +1,6 @@
+class Text:
+    def __init__(self, color=0, value='', position=(0, 0), font=None, **kwargs):
+        self.color = color
+        self.value = value
+        self.position = position
+        self.font = font
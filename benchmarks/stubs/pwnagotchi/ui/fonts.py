@@ -0,0 +1 @@
+Bold = Small = Medium = Huge = None
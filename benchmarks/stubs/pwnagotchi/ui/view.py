@@ -0,0 +1,24 @@
+import threading
+
+BLACK = 0x00
+WHITE = 0xFF
+
+
+class View:
+    # lo que usan los plugins de pwnagotchi.ui.view.View: _lock, add_element, set, remove_element, update
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.elements = {}
+        self.updates = 0
+
+    def add_element(self, key, element):
+        self.elements[key] = element
+
+    def remove_element(self, key):
+        self.elements.pop(key, None)
+
+    def set(self, key, value):
+        self.elements[key].value = value
+
+    def update(self, force=False, new_data=None):
+        self.updates += 1
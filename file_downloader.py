@@ -1,9 +1,262 @@
 import os
 import threading
 import logging
-from flask import Flask, send_from_directory, abort
+import functools
+import gzip
+import zlib
+import time
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from flask import Flask, Response, send_from_directory, send_file, abort, request, make_response
+from markupsafe import escape
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 import pwnagotchi.plugins as plugins
 
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+PAGE_SIZE = 200  # archivos por página en /list
+SORT_KEYS = {'name': 0, 'mtime': 1, 'size': 2}
+
+
+class DirectoryCache:
+    # listado de cada carpeta ya ordenado; se rehace solo cuando cambia el mtime del directorio
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        # tamaño descomprimido de cada .log.gz por (nombre, st_mtime_ns): un archivo nuevo en la
+        # carpeta no obliga a releer el final de todos los gzip al rehacer el listado
+        self.sizes = {}
+
+    def _load(self, path):
+        version = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.entries.get(path)
+            if cached is not None and cached[0] == version:
+                return cached
+        files = []
+        known = self.sizes.get(path, {})
+        sizes = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                # ocultos: entre ellos las copias .<log>.partial que auto_nmap está escribiendo
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        # un .log.gz se lista como .log: con el tamaño del texto, que es lo que se descarga
+                        size = st.st_size
+                        if entry.name.endswith('.log.gz'):
+                            key = (entry.name, st.st_mtime_ns)
+                            size = known.get(key)
+                            if size is None:
+                                size = text_size(entry.path)
+                            sizes[key] = size
+                        files.append((entry.name, st.st_mtime, size))
+                except OSError:
+                    continue
+        orders = {
+            key: sorted(files, key=lambda f, i=index: (f[i], f[0]))
+            for key, index in SORT_KEYS.items()
+        }
+        cached = (version, orders)
+        with self.lock:
+            self.entries[path] = cached
+            self.sizes[path] = sizes
+        return cached
+
+    def page(self, path, sort='name', reverse=False, page=1, size=PAGE_SIZE):
+        # devuelve (versión, páginas, página ajustada al rango, archivos de la página)
+        version, orders = self._load(path)
+        files = orders[sort]
+        pages = max(1, -(-len(files) // size))
+        page = min(max(page, 1), pages)
+        start, end = (page - 1) * size, page * size
+        if reverse:
+            start, end = len(files) - end, len(files) - start
+            items = files[max(start, 0):end][::-1]
+        else:
+            items = files[start:end]
+        return version, pages, page, items
+
+
+def text_size(filepath):
+    if filepath.endswith('.gz'):
+        # tamaño descomprimido: los 4 últimos bytes del gzip (módulo 4 GiB, de sobra para un log)
+        with open(filepath, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack('<I', f.read(4))[0]
+    return os.path.getsize(filepath)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def resolve_file(directory, filename):
+    # los logs que auto_nmap ya comprimió (.log.gz) se sirven descomprimidos y con su nombre original
+    path = os.path.join(directory, filename)
+    if filename.endswith('.log') and not os.path.isfile(path) and os.path.isfile(path + '.gz'):
+        return path + '.gz', True
+    if not os.path.isfile(path):
+        return None, False
+    return path, filename.endswith('.log.gz')
+
+
+def plain_name(name):
+    return name[:-len('.gz')] if name.endswith('.log.gz') else name
+
+
+def send_decompressed(path, filename, as_attachment=False):
+    # se descomprime a trozos mientras se envía; download_name codifica el nombre según RFC 5987
+    # (un SSID con acentos, emojis o comillas no rompe la cabecera Content-Disposition)
+    return send_file(gzip.open(path, 'rb'), mimetype='text/plain', as_attachment=as_attachment,
+                     download_name=plain_name(filename), conditional=False)
+
+
+SERVER_THREADS = 4      # hilos atendiendo peticiones
+MAX_CONNECTIONS = 8     # conexiones simultáneas; el resto espera en la cola del socket
+KEEPALIVE_TIMEOUT = 5   # segundos que una conexión inactiva conserva su hueco
+SERVER_NICE = 10        # los hilos web ceden la CPU al agente
+GZIP_MIN_SIZE = 1024
+GZIP_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def compress_response(response):
+    # gzip/deflate para respuestas de texto ya generadas; los archivos y los streams van tal cual
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or not response.mimetype.startswith(GZIP_TYPES)):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    if 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(data, 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    elif 'deflate' in request.accept_encodings:
+        response.set_data(zlib.compress(data, 6))
+        response.headers['Content-Encoding'] = 'deflate'
+    else:
+        return response
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+class SendfileWrapper:
+    # wsgi.file_wrapper del backend werkzeug: una descarga completa sale con sendfile() sin pasar por
+    # Python; si werkzeug posiciona el archivo para atender un Range se lee por bloques
+    def __init__(self, connection, file, buffer_size=8192):
+        self.connection = connection
+        self.file = file
+        self.buffer_size = buffer_size
+        self.ranged = False
+        self.headers_sent = False
+        self.done = False
+
+    def seekable(self):
+        return self.file.seekable()
+
+    def seek(self, *args):
+        self.ranged = True
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        if not self.ranged and has_fileno(self.file):
+            if not self.headers_sent:
+                # un bloque vacío hace que werkzeug envíe las cabeceras antes del cuerpo
+                self.headers_sent = True
+                return b""
+            self.done = True
+            self.connection.sendfile(self.file)
+            raise StopIteration
+        data = self.file.read(self.buffer_size)
+        if not data:
+            self.done = True
+            raise StopIteration
+        return data
+
+
+def has_fileno(file):
+    try:
+        file.fileno()
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    timeout = KEEPALIVE_TIMEOUT
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ['wsgi.file_wrapper'] = functools.partial(SendfileWrapper, self.connection)
+        return environ
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    # werkzeug con un pool fijo de hilos y un tope de conexiones en lugar de un hilo por conexión.
+    # Sin keep-alive: el manejador de werkzeug cierra y drena el socket tras cada respuesta
+    multithread = True
+    request_queue_size = 32
+
+    def __init__(self, host, port, app, threads=SERVER_THREADS, max_connections=MAX_CONNECTIONS):
+        super().__init__(host, port, app, handler=PooledRequestHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='web_file_server')
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        # sin hueco libre el bucle de accept se para y las conexiones esperan en el backlog
+        self.slots.acquire()
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+
+def serve(app, host, port, backend='auto', threads=SERVER_THREADS, max_connections=MAX_CONNECTIONS):
+    # waitress si está instalado (keep-alive incluido); si no, werkzeug con pool acotado
+    try:
+        # nice es por hilo en Linux y lo heredan los hilos que cree este
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), SERVER_NICE)
+    except (AttributeError, OSError):
+        pass
+    if backend == 'waitress' and waitress is None:
+        logging.warning("[web_file_server] waitress no está instalado, se usa werkzeug")
+    if backend in ('auto', 'waitress') and waitress is not None:
+        logging.info(f"[web_file_server] backend waitress: {threads} hilos, {max_connections} conexiones")
+        waitress.serve(app, host=host, port=port, threads=threads, connection_limit=max_connections,
+                       channel_timeout=KEEPALIVE_TIMEOUT, cleanup_interval=KEEPALIVE_TIMEOUT,
+                       ident='web_file_server', _quiet=True)
+    else:
+        logging.info(f"[web_file_server] backend werkzeug: {threads} hilos, {max_connections} conexiones")
+        PooledWSGIServer(host, port, app, threads, max_connections).serve_forever()
+
+
 class FileWebServerPlugin(plugins.Plugin):
     __author__ = '@jorge'
     __version__ = '1.0'
@@ -12,7 +265,10 @@ class FileWebServerPlugin(plugins.Plugin):
 
     def __init__(self):
         self.web_thread = None
+        self.options = {}
         self.app = Flask(__name__)
+        self.listings = DirectoryCache()
+        self.app.after_request(compress_response)
         self.directories = {
             'files_nmap': '/home/pi/files_nmap',
             'auto_nmap': '/home/pi/auto_nmap',
@@ -34,27 +290,75 @@ class FileWebServerPlugin(plugins.Plugin):
             path = self.directories[folder]
             if not os.path.exists(path):
                 os.makedirs(path)
-            files = os.listdir(path)
-            files.sort()
-            html = f"<h3>Archivos en {folder}:</h3><ul>"
-            for f in files:
-                html += f'<li><a href="/download/{folder}/{f}">{f}</a></li>'
-            html += "</ul><a href='/'>Volver</a>"
-            return html
+            sort, reverse, page = self._listing_args()
+            version, pages, page, files = self.listings.page(path, sort, reverse, page)
+            # la página solo cambia si cambia la carpeta o se pide otro orden/página
+            etag = f"{folder}-{version:x}-{sort}-{int(reverse)}-{page}"
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+            parts = [f"<h3>Archivos en {folder}:</h3>", self._listing_nav(folder, sort, reverse, page, pages), "<ul>"]
+            for name, mtime, size in files:
+                name = plain_name(name)
+                parts.append(
+                    f'<li><a href="/download/{folder}/{quote(name, safe="")}">{escape(name)}</a> {format_size(size)} '
+                    f'{time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))}</li>'
+                )
+            parts.append("</ul>")
+            parts.append(self._listing_nav(folder, sort, reverse, page, pages))
+            parts.append("<a href='/'>Volver</a>")
+            response = make_response("".join(parts))
+            response.set_etag(etag)
+            return response
 
         @self.app.route('/download/<folder>/<filename>')
         def download_file(folder, filename):
             if folder not in self.directories:
                 return abort(404)
             directory = self.directories[folder]
-            filepath = os.path.join(directory, filename)
-            if not os.path.exists(filepath):
+            filepath, compressed = resolve_file(directory, filename)
+            if filepath is None:
                 return abort(404)
+            if compressed:
+                return send_decompressed(filepath, filename, as_attachment=True)
             return send_from_directory(directory, filename, as_attachment=True)
 
+    def _listing_args(self):
+        sort = request.args.get('sort', 'name')
+        if sort not in SORT_KEYS:
+            sort = 'name'
+        # por defecto los más recientes y los más grandes primero
+        reverse = request.args.get('order', 'asc' if sort == 'name' else 'desc') == 'desc'
+        return sort, reverse, request.args.get('page', 1, type=int)
+
+    def _listing_nav(self, folder, sort, reverse, page, pages):
+        order = 'desc' if reverse else 'asc'
+        links = []
+        for key, label in (('name', 'nombre'), ('mtime', 'fecha'), ('size', 'tamaño')):
+            if key == sort:
+                flip = 'asc' if reverse else 'desc'
+                links.append(f'<a href="/list/{folder}?sort={key}&order={flip}"><strong>{label} {"↓" if reverse else "↑"}</strong></a>')
+            else:
+                links.append(f'<a href="/list/{folder}?sort={key}">{label}</a>')
+        nav = ["<p>Ordenar: ", " ".join(links)]
+        if pages > 1:
+            nav.append(" | ")
+            if page > 1:
+                nav.append(f'<a href="/list/{folder}?sort={sort}&order={order}&page={page - 1}">← Anterior</a>')
+            nav.append(f" Página {page} de {pages} ")
+            if page < pages:
+                nav.append(f'<a href="/list/{folder}?sort={sort}&order={order}&page={page + 1}">Siguiente →</a>')
+        nav.append("</p>")
+        return "".join(nav)
+
     def start_web_server(self):
         logging.info("[web_file_server] Iniciando servidor web en puerto 9666")
-        self.app.run(host='0.0.0.0', port=9666, debug=False, use_reloader=False)
+        serve(
+            self.app, '0.0.0.0', 9666,
+            backend=self.options.get('server', 'auto'),
+            threads=int(self.options.get('threads', SERVER_THREADS)),
+            max_connections=int(self.options.get('max_connections', MAX_CONNECTIONS)),
+        )
 
     def on_loaded(self):
         if self.web_thread is None:
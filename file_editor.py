@@ -1,11 +1,604 @@
 import os
 import threading
 import logging
+import functools
+import gzip
+import zlib
+import time
+import datetime
+import fnmatch
 import io
 import zipfile
-from flask import Flask, send_from_directory, abort, request, redirect, send_file
+import re
+import sqlite3
+import ipaddress
+import struct
+import json
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, send_from_directory, abort, request, redirect, send_file, make_response
+from markupsafe import escape
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 import pwnagotchi.plugins as plugins
 
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+PAGE_SIZE = 200  # archivos por página en /list
+SORT_KEYS = {'name': 0, 'mtime': 1, 'size': 2}
+
+
+class DirectoryCache:
+    # listado de cada carpeta ya ordenado; se rehace solo cuando cambia el mtime del directorio
+    # o cuando se avisa de que un archivo cambió en su sitio (/edit no toca el mtime de la carpeta)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        # tamaño descomprimido de cada .log.gz por (nombre, st_mtime_ns): un archivo nuevo en la
+        # carpeta no obliga a releer el final de todos los gzip al rehacer el listado
+        self.sizes = {}
+        self.touched = {}
+
+    def invalidate(self, path):
+        with self.lock:
+            self.touched[path] = max(self.touched.get(path, 0) + 1, time.time_ns())
+
+    def _load(self, path):
+        version = os.stat(path).st_mtime_ns
+        with self.lock:
+            version = max(version, self.touched.get(path, 0))
+            cached = self.entries.get(path)
+            if cached is not None and cached[0] == version:
+                return cached
+        files = []
+        known = self.sizes.get(path, {})
+        sizes = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                # ocultos: entre ellos las copias .<log>.partial que auto_nmap está escribiendo
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        # un .log.gz se lista como .log: con el tamaño del texto, que es lo que se descarga
+                        size = st.st_size
+                        if entry.name.endswith('.log.gz'):
+                            key = (entry.name, st.st_mtime_ns)
+                            size = known.get(key)
+                            if size is None:
+                                size = text_size(entry.path)
+                            sizes[key] = size
+                        files.append((entry.name, st.st_mtime, size))
+                except OSError:
+                    continue
+        orders = {
+            key: sorted(files, key=lambda f, i=index: (f[i], f[0]))
+            for key, index in SORT_KEYS.items()
+        }
+        cached = (version, orders)
+        with self.lock:
+            self.entries[path] = cached
+            self.sizes[path] = sizes
+        return cached
+
+    def page(self, path, sort='name', reverse=False, page=1, size=PAGE_SIZE):
+        # devuelve (versión, páginas, página ajustada al rango, archivos de la página)
+        version, orders = self._load(path)
+        files = orders[sort]
+        pages = max(1, -(-len(files) // size))
+        page = min(max(page, 1), pages)
+        start, end = (page - 1) * size, page * size
+        if reverse:
+            start, end = len(files) - end, len(files) - start
+            items = files[max(start, 0):end][::-1]
+        else:
+            items = files[start:end]
+        return version, pages, page, items
+
+
+# ya comprimidos: se guardan tal cual en el ZIP en lugar de volver a pasarlos por deflate
+STORED_EXTENSIONS = ('.gz', '.zip', '.bz2', '.xz', '.7z', '.png', '.jpg', '.jpeg')
+ZIP_CHUNK = 64 * 1024
+
+
+class ZipSink(io.RawIOBase):
+    # destino no posicionable para zipfile: acumula lo escrito hasta que el generador lo entrega
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def parse_day(value, end=False):
+    # 'YYYY-MM-DD' -> timestamp del inicio (o del final) de ese día
+    if not value:
+        return None
+    day = datetime.datetime.strptime(value, "%Y-%m-%d")
+    if end:
+        day += datetime.timedelta(days=1)
+    return day.timestamp()
+
+
+def stream_zip(directory, since=None, until=None, pattern=None):
+    # genera el ZIP mientras recorre la carpeta: en memoria solo hay un bloque y el índice central
+    return (chunk for chunk in _zip_chunks(directory, since, until, pattern) if chunk)
+
+
+def _zip_chunks(directory, since, until, pattern):
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in os.walk(directory):
+            # lo oculto no se empaqueta, igual que no se lista (copias .<log>.partial a medio escribir)
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for file in sorted(files):
+                if file.startswith('.'):
+                    continue
+                filepath = os.path.join(root, file)
+                # los logs comprimidos por auto_nmap salen como el .log original: el patrón y el
+                # contenido son los mismos que antes de comprimirlos
+                compressed = file.endswith('.log.gz')
+                arcname = plain_name(os.path.relpath(filepath, start=directory))
+                if pattern and not fnmatch.fnmatch(arcname, pattern):
+                    continue
+                try:
+                    mtime = os.path.getmtime(filepath)
+                    if (since is not None and mtime < since) or (until is not None and mtime >= until):
+                        continue
+                    info = zipfile.ZipInfo.from_file(filepath, arcname, strict_timestamps=False)
+                    if file.lower().endswith(STORED_EXTENSIONS) and not compressed:
+                        info.compress_type = zipfile.ZIP_STORED
+                    else:
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                    with (gzip.open if compressed else open)(filepath, 'rb') as src, zipf.open(info, 'w') as dest:
+                        while True:
+                            chunk = src.read(ZIP_CHUNK)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            yield sink.drain()
+                except OSError as e:
+                    logging.warning(f"[web_file_server] {arcname} omitido del ZIP: {e}")
+                yield sink.drain()
+    yield sink.drain()
+
+
+VIEW_WINDOW = 64 * 1024  # bytes por página del visor
+
+# tail -f: pide por Range solo lo que se ha añadido desde el último byte mostrado
+TAIL_SCRIPT = """
+<script>
+let pos = {end};
+const raw = {raw};
+const decoder = new TextDecoder();
+const pre = document.getElementById("content");
+async function poll() {
+    const r = await fetch(raw, {headers: {Range: "bytes=" + pos + "-"}, cache: "no-store"});
+    if (r.status !== 206) return;
+    const data = await r.arrayBuffer();
+    pos += data.byteLength;
+    pre.textContent += decoder.decode(data, {stream: true});
+    window.scrollTo(0, document.body.scrollHeight);
+}
+setInterval(poll, 2000);
+</script>
+"""
+
+
+def text_size(filepath):
+    if filepath.endswith('.gz'):
+        # tamaño descomprimido: los 4 últimos bytes del gzip (módulo 4 GiB, de sobra para un log)
+        with open(filepath, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack('<I', f.read(4))[0]
+    return os.path.getsize(filepath)
+
+
+def read_window(filepath, offset, window=VIEW_WINDOW):
+    # lee solo [offset, offset + window) recortado a líneas completas; devuelve (texto, inicio, fin, tamaño).
+    # En un .gz el seek descomprime hasta offset sin guardar nada en memoria
+    size = text_size(filepath)
+    with (gzip.open if filepath.endswith('.gz') else open)(filepath, 'rb') as f:
+        start = min(max(offset, 0), size)
+        if start > 0:
+            # un byte antes para saber si offset ya cae al principio de una línea
+            f.seek(start - 1)
+            data = f.read(window + 1)
+            cut = data.find(b"\n")
+            if cut == -1:
+                cut = 0
+            data = data[cut + 1:]
+            start += cut
+        else:
+            data = f.read(window)
+    end = start + len(data)
+    if end < size:
+        cut = data.rfind(b"\n")
+        if cut != -1:
+            data = data[:cut + 1]
+            end = start + len(data)
+    return data.decode('utf-8', errors='replace'), start, end, size
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def resolve_file(directory, filename, staging=None):
+    # los logs que auto_nmap ya comprimió (.log.gz) se sirven descomprimidos y con su nombre original
+    if staging:
+        # escaneo en curso: la copia en RAM va por delante de la de la SD (que se copia cada minuto)
+        live = os.path.join(staging, filename)
+        if os.path.isfile(live):
+            return live, False
+    path = os.path.join(directory, filename)
+    if filename.endswith('.log') and not os.path.isfile(path) and os.path.isfile(path + '.gz'):
+        return path + '.gz', True
+    if not os.path.isfile(path):
+        return None, False
+    return path, filename.endswith('.log.gz')
+
+
+def plain_name(name):
+    return name[:-len('.gz')] if name.endswith('.log.gz') else name
+
+
+def send_decompressed(path, filename, as_attachment=False):
+    # se descomprime a trozos mientras se envía; download_name codifica el nombre según RFC 5987
+    # (un SSID con acentos, emojis o comillas no rompe la cabecera Content-Disposition)
+    return send_file(gzip.open(path, 'rb'), mimetype='text/plain', as_attachment=as_attachment,
+                     download_name=plain_name(filename), conditional=False)
+
+
+STAGING_DIR = '/dev/shm/auto_nmap'  # logs de los escaneos en curso (LogStager de auto_nmap)
+
+SEARCH_DB = '/home/pi/.auto_nmap/search.db'
+SEARCH_REFRESH = 10  # segundos entre repasos de la carpeta aunque su mtime no cambie (logs que crecen)
+SEARCH_POLL = 2      # cada cuánto mira el hilo de fondo si la carpeta cambió
+SEARCH_LIMIT = 200
+SCAN_LOG = re.compile(r'^nmap_scan_(.+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.log(?:\.gz)?$')
+REPORT_LINE = re.compile(r'^Nmap scan report for (?:(\S+) \()?([\d.]+)\)?$')
+PORT_LINE = re.compile(r'^(\d+)/(tcp|udp)\s+open\s+(\S+)\s*(.*)$')
+TOKEN = re.compile(r'[a-z0-9][a-z0-9._-]{2,}')
+TERM_KINDS = ('ip', 'port', 'svc', 'tok', 'ssid')
+
+
+def index_terms(text, ssid):
+    # términos de un log -oN como pares (término, ip); la ip va vacía en los de toda la red
+    terms = {(f"ssid:{ssid.lower()}", "")}
+    ip = None
+    for line in text.splitlines():
+        match = REPORT_LINE.match(line)
+        if match:
+            hostname, ip = match.groups()
+            terms.add((f"ip:{ip}", ip))
+            if hostname:
+                terms.update((f"tok:{token}", ip) for token in TOKEN.findall(hostname.lower()))
+            continue
+        match = PORT_LINE.match(line)
+        if match and ip:
+            port, _, service, version = match.groups()
+            terms.add((f"port:{port}", ip))
+            terms.add((f"svc:{service.lower().rstrip('?')}", ip))
+            terms.update((f"tok:{token}", ip) for token in TOKEN.findall(version.lower()))
+    return terms
+
+
+def query_terms(word):
+    # 'port:445' tal cual; '445' es un puerto, '10.0.0.1' una ip y el resto servicio, banner o SSID
+    word = word.lower()
+    kind, _, value = word.partition(':')
+    if value and kind in TERM_KINDS:
+        return [word]
+    if word.isdigit():
+        return [f"port:{word}"]
+    if re.fullmatch(r'[\d.]+', word):
+        return [f"ip:{word}"]
+    return [f"svc:{word}", f"tok:{word}", f"ssid:{word}"]
+
+
+class SearchIndex:
+    # índice invertido de los logs de escaneo; solo se indexan los archivos nuevos o que cambiaron.
+    # Los términos van a una tabla aparte y las ips como enteros para que ocupe poco en la SD
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY, name TEXT UNIQUE, ssid TEXT, size INTEGER, mtime INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE);
+    CREATE TABLE IF NOT EXISTS postings (
+        term_id INTEGER, file_id INTEGER, ip INTEGER,
+        PRIMARY KEY (term_id, file_id, ip)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, directory):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+        self.known = {
+            name: (file_id, size, mtime)
+            for file_id, name, size, mtime in self.db.execute("SELECT id, name, size, mtime FROM files")
+        }
+        self.term_ids = dict(self.db.execute("SELECT term, id FROM terms"))
+        self.version = None
+        self.checked = float('-inf')
+
+    def refresh(self):
+        with self.lock:
+            try:
+                version = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if version == self.version and time.monotonic() - self.checked < SEARCH_REFRESH:
+                return
+            seen = set()
+            stale = False
+            with self.db, os.scandir(self.directory) as it:
+                for entry in it:
+                    match = SCAN_LOG.match(entry.name)
+                    if not match:
+                        continue
+                    try:
+                        st = entry.stat()
+                        seen.add(entry.name)
+                        known = self.known.get(entry.name)
+                        if known is not None and known[1:] == (st.st_size, st.st_mtime_ns):
+                            continue
+                        if known is not None:
+                            self._drop(entry.name)
+                            stale = True
+                        self._index(entry.path, entry.name, match.group(1), st)
+                    except OSError as e:
+                        logging.warning(f"[web_file_server] No se pudo indexar {entry.name}: {e}")
+                for name in set(self.known) - seen:
+                    self._drop(name)
+                    stale = True
+                if stale:
+                    # sin índice por archivo: las entradas huérfanas se purgan de una vez
+                    self.db.execute("DELETE FROM postings WHERE file_id NOT IN (SELECT id FROM files)")
+            self.version = version
+            self.checked = time.monotonic()
+
+    def _term_id(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.db.execute("INSERT INTO terms (term) VALUES (?)", (term,)).lastrowid
+            self.term_ids[term] = term_id
+        return term_id
+
+    def _index(self, path, name, ssid, st):
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rt', encoding='utf-8', errors='replace') as f:
+            terms = index_terms(f.read(), ssid)
+        file_id = self.db.execute(
+            "INSERT INTO files (name, ssid, size, mtime) VALUES (?, ?, ?, ?)",
+            (name, ssid, st.st_size, st.st_mtime_ns),
+        ).lastrowid
+        self.db.executemany(
+            "INSERT OR IGNORE INTO postings VALUES (?, ?, ?)",
+            [(self._term_id(term), file_id, int(ipaddress.IPv4Address(ip)) if ip else 0) for term, ip in terms],
+        )
+        self.known[name] = (file_id, st.st_size, st.st_mtime_ns)
+
+    def _drop(self, name):
+        self.db.execute("DELETE FROM files WHERE id = ?", (self.known.pop(name)[0],))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        # todas las palabras deben aparecer en el mismo escaneo; devuelve [(archivo, ssid, ips)], recientes primero
+        words = query.split()
+        if not words:
+            return []
+        with self.lock:
+            selects = []
+            term_ids = []
+            for word in words:
+                ids = {self.term_ids[term] for term in query_terms(word) if term in self.term_ids}
+                if not ids:
+                    return []
+                selects.append(f"SELECT file_id FROM postings WHERE term_id IN ({','.join('?' * len(ids))})")
+                term_ids.extend(ids)
+            # la intersección y el LIMIT los resuelve SQLite: solo se enlazan ids de términos, nunca de archivos
+            # (SQLITE_MAX_VARIABLE_NUMBER es 999 en las versiones antiguas)
+            rows = self.db.execute(
+                f"WITH top AS (SELECT id, name, ssid, mtime FROM files WHERE id IN ({' INTERSECT '.join(selects)}) "
+                f"ORDER BY mtime DESC LIMIT ?) "
+                f"SELECT top.id, top.name, top.ssid, postings.ip FROM top LEFT JOIN postings "
+                f"ON postings.file_id = top.id AND postings.ip != 0 "
+                f"AND postings.term_id IN ({','.join('?' * len(term_ids))}) "
+                f"ORDER BY top.mtime DESC, top.id",
+                [*term_ids, limit, *term_ids],
+            ).fetchall()
+        results = {}
+        for file_id, name, ssid, ip in rows:
+            ips = results.setdefault(file_id, (name, ssid, set()))[2]
+            if ip:
+                ips.add(ip)
+        return [
+            (name, ssid, [str(ipaddress.IPv4Address(ip)) for ip in sorted(ips)])
+            for name, ssid, ips in results.values()
+        ]
+
+
+SCAN_DB = '/home/pi/.auto_nmap/scans.db'
+API_LIMIT = 100
+API_MAX_LIMIT = 500
+SCAN_COLUMNS = ('id', 'ssid', 'bssid', 'network', 'gateway', 'started', 'finished', 'log_file')
+PORT_COLUMNS = ('port', 'proto', 'state', 'service', 'product', 'version')
+
+
+def parse_time(value):
+    # epoch en segundos o fecha ISO ('2025-01-31', '2025-01-31T10:00')
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def open_scan_db():
+    # solo lectura: auto_nmap es el único que escribe en scans.db
+    if not os.path.exists(SCAN_DB):
+        return None
+    db = sqlite3.connect(f"file:{SCAN_DB}?mode=ro", uri=True)
+    db.execute("PRAGMA query_only = 1")
+    return db
+
+
+SERVER_THREADS = 4      # hilos atendiendo peticiones
+MAX_CONNECTIONS = 8     # conexiones simultáneas; el resto espera en la cola del socket
+KEEPALIVE_TIMEOUT = 5   # segundos que una conexión inactiva conserva su hueco
+SERVER_NICE = 10        # los hilos web ceden la CPU al agente
+GZIP_MIN_SIZE = 1024
+GZIP_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def compress_response(response):
+    # gzip/deflate para respuestas de texto ya generadas; los archivos y los streams van tal cual
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or not response.mimetype.startswith(GZIP_TYPES)):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    if 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(data, 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    elif 'deflate' in request.accept_encodings:
+        response.set_data(zlib.compress(data, 6))
+        response.headers['Content-Encoding'] = 'deflate'
+    else:
+        return response
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+class SendfileWrapper:
+    # wsgi.file_wrapper del backend werkzeug: una descarga completa sale con sendfile() sin pasar por
+    # Python; si werkzeug posiciona el archivo para atender un Range se lee por bloques
+    def __init__(self, connection, file, buffer_size=8192):
+        self.connection = connection
+        self.file = file
+        self.buffer_size = buffer_size
+        self.ranged = False
+        self.headers_sent = False
+        self.done = False
+
+    def seekable(self):
+        return self.file.seekable()
+
+    def seek(self, *args):
+        self.ranged = True
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        if not self.ranged and has_fileno(self.file):
+            if not self.headers_sent:
+                # un bloque vacío hace que werkzeug envíe las cabeceras antes del cuerpo
+                self.headers_sent = True
+                return b""
+            self.done = True
+            self.connection.sendfile(self.file)
+            raise StopIteration
+        data = self.file.read(self.buffer_size)
+        if not data:
+            self.done = True
+            raise StopIteration
+        return data
+
+
+def has_fileno(file):
+    try:
+        file.fileno()
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    timeout = KEEPALIVE_TIMEOUT
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ['wsgi.file_wrapper'] = functools.partial(SendfileWrapper, self.connection)
+        return environ
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    # werkzeug con un pool fijo de hilos y un tope de conexiones en lugar de un hilo por conexión.
+    # Sin keep-alive: el manejador de werkzeug cierra y drena el socket tras cada respuesta
+    multithread = True
+    request_queue_size = 32
+
+    def __init__(self, host, port, app, threads=SERVER_THREADS, max_connections=MAX_CONNECTIONS):
+        super().__init__(host, port, app, handler=PooledRequestHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='web_file_server')
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        # sin hueco libre el bucle de accept se para y las conexiones esperan en el backlog
+        self.slots.acquire()
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+
+def serve(app, host, port, backend='auto', threads=SERVER_THREADS, max_connections=MAX_CONNECTIONS):
+    # waitress si está instalado (keep-alive incluido); si no, werkzeug con pool acotado
+    try:
+        # nice es por hilo en Linux y lo heredan los hilos que cree este
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), SERVER_NICE)
+    except (AttributeError, OSError):
+        pass
+    if backend == 'waitress' and waitress is None:
+        logging.warning("[web_file_server] waitress no está instalado, se usa werkzeug")
+    if backend in ('auto', 'waitress') and waitress is not None:
+        logging.info(f"[web_file_server] backend waitress: {threads} hilos, {max_connections} conexiones")
+        waitress.serve(app, host=host, port=port, threads=threads, connection_limit=max_connections,
+                       channel_timeout=KEEPALIVE_TIMEOUT, cleanup_interval=KEEPALIVE_TIMEOUT,
+                       ident='web_file_server', _quiet=True)
+    else:
+        logging.info(f"[web_file_server] backend werkzeug: {threads} hilos, {max_connections} conexiones")
+        PooledWSGIServer(host, port, app, threads, max_connections).serve_forever()
+
+
 class FileWebServerPlugin(plugins.Plugin):
     __author__ = '@jorge'
     __version__ = '1.3'
@@ -14,7 +607,13 @@ class FileWebServerPlugin(plugins.Plugin):
 
     def __init__(self):
         self.web_thread = None
+        self.options = {}
+        self.lock = threading.Lock()
         self.app = Flask(__name__)
+        self.listings = DirectoryCache()
+        self.search_index = None
+        self.app.after_request(compress_response)
+        self.staging = {'auto_nmap': STAGING_DIR}
         self.directories = {
             'files_nmap': '/home/pi/files_nmap',
             'auto_nmap': '/home/pi/auto_nmap',
@@ -87,9 +686,43 @@ class FileWebServerPlugin(plugins.Plugin):
             html = f"<h2>📁 Archivos disponibles</h2><ul>"
             for name in self.directories:
                 html += f'<li><a href="/list/{name}">{name}</a></li>'
-            html += "</ul>"
+            html += "</ul><p><a href='/search'>🔎 Buscar en los escaneos</a></p>"
             return self.style + html
 
+        @self.app.route('/api/scans')
+        def api_scans():
+            return self._api_scans()
+
+        @self.app.route('/api/scans/<int:scan_id>')
+        def api_scan(scan_id):
+            return self._api_scan(scan_id)
+
+        @self.app.route('/search')
+        def search():
+            query = request.args.get('q', '').strip()
+            parts = [
+                self.style,
+                "<h3>🔎 Buscar en los escaneos</h3>",
+                f'<form action="/search"><input type="text" name="q" value="{escape(query)}" '
+                f'placeholder="445 rtsp ssid:cafe ip:192.168.1.1"> <input type="submit" value="Buscar"></form>',
+            ]
+            if query:
+                started = time.monotonic()
+                index = self._search_index()
+                if index.version is None:
+                    # búsqueda antes del primer repaso del hilo de fondo
+                    index.refresh()
+                results = index.search(query)
+                parts.append(f"<p>{len(results)} escaneos ({(time.monotonic() - started) * 1000:.0f} ms)</p><ul>")
+                for name, ssid, ips in results:
+                    parts.append(
+                        f'<li><strong>{escape(ssid)}</strong> {escape(plain_name(name))}<br>{escape(" ".join(ips))}<br>'
+                        f'<a href="/view/auto_nmap/{quote(plain_name(name), safe="")}">👁️ Ver</a></li>'
+                    )
+                parts.append("</ul>")
+            parts.append("<a href='/'>← Volver</a>")
+            return "".join(parts)
+
         @self.app.route('/list/<folder>')
         def list_files(folder):
             if folder not in self.directories:
@@ -97,31 +730,57 @@ class FileWebServerPlugin(plugins.Plugin):
             path = self.directories[folder]
             if not os.path.exists(path):
                 os.makedirs(path)
-            files = os.listdir(path)
-            files.sort()
-            html = f"""
+            sort, reverse, page = self._listing_args()
+            version, pages, page, files = self.listings.page(path, sort, reverse, page)
+            # la página solo cambia si cambia la carpeta o se pide otro orden/página
+            etag = f"{folder}-{version:x}-{sort}-{int(reverse)}-{page}"
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+            parts = [
+                self.style,
+                f"""
             <h3>📂 Archivos en: {folder}</h3>
             <p><a class="download-all" href="/download_all/{folder}">⬇️ Descargar todo (ZIP)</a></p>
-            <ul>
-            """
-            for f in files:
-                html += (
-                    f'<li><strong>{f}</strong><br>'
-                    f'<a href="/download/{folder}/{f}">⬇️ Descargar</a>'
-                    f'<a href="/view/{folder}/{f}">👁️ Ver</a>'
-                    f'<a href="/edit/{folder}/{f}">✏️ Editar</a></li>'
+            <form action="/download_all/{folder}">
+                Desde <input type="date" name="since"> hasta <input type="date" name="until">
+                Patrón <input type="text" name="glob" placeholder="*.log">
+                <input type="submit" value="ZIP filtrado">
+            </form>
+            """,
+                self._listing_nav(folder, sort, reverse, page, pages),
+                "<ul>",
+            ]
+            for name, mtime, size in files:
+                # los .log.gz son de solo lectura: /edit no los abre
+                compressed = name.endswith('.log.gz')
+                name = plain_name(name)
+                # los nombres de los logs vienen de SSIDs ajenos
+                quoted = quote(name, safe='')
+                parts.append(
+                    f'<li><strong>{escape(name)}</strong> <small>{format_size(size)} · '
+                    f'{time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))}</small><br>'
+                    f'<a href="/download/{folder}/{quoted}">⬇️ Descargar</a>'
+                    f'<a href="/view/{folder}/{quoted}">👁️ Ver</a>'
+                    + ('' if compressed else f'<a href="/edit/{folder}/{quoted}">✏️ Editar</a>') + '</li>'
                 )
-            html += "</ul><a href='/'>← Volver</a>"
-            return self.style + html
+            parts.append("</ul>")
+            parts.append(self._listing_nav(folder, sort, reverse, page, pages))
+            parts.append("<a href='/'>← Volver</a>")
+            response = make_response("".join(parts))
+            response.set_etag(etag)
+            return response
 
         @self.app.route('/download/<folder>/<filename>')
         def download_file(folder, filename):
             if folder not in self.directories:
                 return abort(404)
             directory = self.directories[folder]
-            filepath = os.path.join(directory, filename)
-            if not os.path.exists(filepath):
+            filepath, compressed = resolve_file(directory, filename, self.staging.get(folder))
+            if filepath is None:
                 return abort(404)
+            if compressed:
+                return send_decompressed(filepath, filename, as_attachment=True)
             return send_from_directory(directory, filename, as_attachment=True)
 
         @self.app.route('/download_all/<folder>')
@@ -131,38 +790,68 @@ class FileWebServerPlugin(plugins.Plugin):
             directory = self.directories[folder]
             if not os.path.exists(directory):
                 return abort(404)
-
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(directory):
-                    for file in files:
-                        filepath = os.path.join(root, file)
-                        arcname = os.path.relpath(filepath, start=directory)
-                        zipf.write(filepath, arcname)
-            zip_buffer.seek(0)
-            return send_file(
-                zip_buffer,
+            try:
+                since = parse_day(request.args.get('since'))
+                until = parse_day(request.args.get('until'), end=True)
+            except ValueError:
+                return abort(400)
+            pattern = request.args.get('glob') or None
+            return Response(
+                stream_zip(directory, since, until, pattern),
                 mimetype='application/zip',
-                download_name=f"{folder}_all_files.zip",
-                as_attachment=True
+                headers={'Content-Disposition': f'attachment; filename="{folder}_all_files.zip"'},
             )
 
         @self.app.route('/view/<folder>/<filename>')
         def view_file(folder, filename):
             if folder not in self.directories:
                 return abort(404)
-            filepath = os.path.join(self.directories[folder], filename)
-            if not os.path.isfile(filepath):
+            filepath, _ = resolve_file(self.directories[folder], filename, self.staging.get(folder))
+            if filepath is None:
                 return abort(404)
+            tail = request.args.get('tail') == '1'
             try:
-                with open(filepath, "r", encoding="utf-8", errors="replace") as f:
-                    content = f.read()
-                html = f"<h3>👁️ Viendo: {filename}</h3><pre>{content}</pre>"
-                html += f"<a href='/list/{folder}'>← Volver</a>"
-                return self.style + html
+                if tail:
+                    offset = text_size(filepath) - VIEW_WINDOW
+                else:
+                    offset = request.args.get('offset', 0, type=int)
+                content, start, end, size = read_window(filepath, offset)
+                # el nombre sale del SSID, que lo elige quien emite la red
+                quoted = quote(filename, safe='')
+                base = f"/view/{folder}/{quoted}"
+                nav = [f"<p>Bytes {start}-{end} de {size} · "]
+                if start > 0:
+                    nav.append(f'<a href="{base}">⏮ Inicio</a>'
+                               f'<a href="{base}?offset={max(0, start - VIEW_WINDOW)}">← Anterior</a>')
+                if end < size:
+                    nav.append(f'<a href="{base}?offset={end}">Siguiente →</a>'
+                               f'<a href="{base}?offset={size - VIEW_WINDOW}">Final ⏭</a>')
+                if not tail:
+                    nav.append(f'<a href="{base}?tail=1">📜 Seguir (tail -f)</a>')
+                nav.append(f'<a href="/raw/{folder}/{quoted}">Texto plano</a></p>')
+                parts = [self.style, f"<h3>👁️ Viendo: {escape(filename)}</h3>", "".join(nav),
+                         f'<pre id="content">{escape(content)}</pre>']
+                if tail:
+                    raw = json.dumps(f"/raw/{folder}/{quoted}")
+                    parts.append(TAIL_SCRIPT.replace("{raw}", raw).replace("{end}", str(end)))
+                parts.append(f"<a href='/list/{folder}'>← Volver</a>")
+                return "".join(parts)
             except Exception as e:
                 return self.style + f"<p>⚠️ Error leyendo archivo: {e}</p><a href='/list/{folder}'>← Volver</a>"
 
+        @self.app.route('/raw/<folder>/<filename>')
+        def raw_file(folder, filename):
+            # send_file con conditional=True atiende Range: solo se lee el tramo pedido
+            if folder not in self.directories:
+                return abort(404)
+            filepath, compressed = resolve_file(self.directories[folder], filename, self.staging.get(folder))
+            if filepath is None:
+                return abort(404)
+            if compressed:
+                # sin Range: un .gz no permite saltar a un offset sin descomprimir lo anterior
+                return send_decompressed(filepath, filename)
+            return send_file(filepath, mimetype='text/plain', conditional=True, etag=True)
+
         @self.app.route('/edit/<folder>/<filename>', methods=['GET', 'POST'])
         def edit_file(folder, filename):
             if folder not in self.directories:
@@ -176,6 +865,7 @@ class FileWebServerPlugin(plugins.Plugin):
                 try:
                     with open(filepath, "w", encoding="utf-8") as f:
                         f.write(new_content)
+                    self.listings.invalidate(self.directories[folder])
                     return redirect(f"/view/{folder}/{filename}")
                 except Exception as e:
                     return self.style + f"<p>⚠️ Error guardando archivo: {e}</p><a href='/list/{folder}'>← Volver</a>"
@@ -195,14 +885,140 @@ class FileWebServerPlugin(plugins.Plugin):
             except Exception as e:
                 return self.style + f"<p>⚠️ Error abriendo archivo: {e}</p><a href='/list/{folder}'>← Volver</a>"
 
+    def _api_scans(self):
+        try:
+            since = parse_time(request.args.get('since'))
+            start = parse_time(request.args.get('from'))
+            until = parse_time(request.args.get('until'))
+            cursor = request.args.get('cursor', 0, type=int)
+            limit = min(max(request.args.get('limit', API_LIMIT, type=int), 1), API_MAX_LIMIT)
+            port = request.args.get('port', type=int)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        # cursor = último id entregado: estable aunque lleguen escaneos nuevos entre páginas
+        where, params = ["s.id > ?"], [cursor]
+        if since is not None:
+            # sincronización: lo creado o terminado después de 'since'
+            where.append("COALESCE(s.finished, s.started) > ?")
+            params.append(since)
+        if start is not None:
+            where.append("s.started >= ?")
+            params.append(start)
+        if until is not None:
+            where.append("s.started < ?")
+            params.append(until)
+        if request.args.get('ssid'):
+            where.append("s.ssid = ?")
+            params.append(request.args['ssid'])
+        if port is not None:
+            where.append("EXISTS (SELECT 1 FROM ports p WHERE p.scan_id = s.id AND p.port = ? AND p.state = 'open')")
+            params.append(port)
+        if request.args.get('service'):
+            where.append("EXISTS (SELECT 1 FROM ports p WHERE p.scan_id = s.id AND p.service = ? AND p.state = 'open')")
+            params.append(request.args['service'])
+        db = open_scan_db()
+        if db is None:
+            return jsonify(scans=[], next_cursor=None)
+        try:
+            rows = db.execute(
+                f"SELECT {', '.join('s.' + column for column in SCAN_COLUMNS)}, "
+                "(SELECT COUNT(*) FROM hosts h WHERE h.scan_id = s.id), "
+                "(SELECT COUNT(*) FROM ports p WHERE p.scan_id = s.id AND p.state = 'open') "
+                f"FROM scans s WHERE {' AND '.join(where)} ORDER BY s.id LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+        finally:
+            db.close()
+        scans = [
+            {**dict(zip(SCAN_COLUMNS, row)), 'log_file': row[7] and os.path.basename(row[7]),
+             'hosts': row[8], 'open_ports': row[9]}
+            for row in rows
+        ]
+        next_cursor = scans[-1]['id'] if len(scans) == limit else None
+        return jsonify(scans=scans, next_cursor=next_cursor)
+
+    def _api_scan(self, scan_id):
+        db = open_scan_db()
+        if db is None:
+            return jsonify(error='sin escaneos'), 404
+        try:
+            row = db.execute(f"SELECT {', '.join(SCAN_COLUMNS)} FROM scans WHERE id = ?", (scan_id,)).fetchone()
+            if row is None:
+                return jsonify(error='escaneo no encontrado'), 404
+            hosts = {
+                ip: {'ip': ip, 'mac': mac, 'vendor': vendor, 'hostname': hostname, 'ports': []}
+                for ip, mac, vendor, hostname in db.execute(
+                    "SELECT ip, mac, vendor, hostname FROM hosts WHERE scan_id = ?", (scan_id,))
+            }
+            for ip, *port in db.execute(
+                    f"SELECT ip, {', '.join(PORT_COLUMNS)} FROM ports WHERE scan_id = ? ORDER BY port", (scan_id,)):
+                hosts.setdefault(ip, {'ip': ip, 'mac': None, 'vendor': None, 'hostname': None, 'ports': []})
+                hosts[ip]['ports'].append(dict(zip(PORT_COLUMNS, port)))
+        finally:
+            db.close()
+        scan = dict(zip(SCAN_COLUMNS, row))
+        scan['log_file'] = scan['log_file'] and os.path.basename(scan['log_file'])
+        scan['hosts'] = sorted(hosts.values(), key=lambda host: ipaddress.ip_address(host['ip']))
+        return jsonify(scan)
+
+    def _search_index(self):
+        with self.lock:
+            if self.search_index is None:
+                self.search_index = SearchIndex(SEARCH_DB, self.directories['auto_nmap'])
+            return self.search_index
+
+    def _listing_args(self):
+        sort = request.args.get('sort', 'name')
+        if sort not in SORT_KEYS:
+            sort = 'name'
+        # por defecto los más recientes y los más grandes primero
+        reverse = request.args.get('order', 'asc' if sort == 'name' else 'desc') == 'desc'
+        return sort, reverse, request.args.get('page', 1, type=int)
+
+    def _listing_nav(self, folder, sort, reverse, page, pages):
+        order = 'desc' if reverse else 'asc'
+        links = []
+        for key, label in (('name', 'nombre'), ('mtime', 'fecha'), ('size', 'tamaño')):
+            if key == sort:
+                flip = 'asc' if reverse else 'desc'
+                links.append(f'<a href="/list/{folder}?sort={key}&order={flip}"><strong>{label} {"↓" if reverse else "↑"}</strong></a>')
+            else:
+                links.append(f'<a href="/list/{folder}?sort={key}">{label}</a>')
+        nav = ["<p>Ordenar: ", " ".join(links)]
+        if pages > 1:
+            nav.append(" | ")
+            if page > 1:
+                nav.append(f'<a href="/list/{folder}?sort={sort}&order={order}&page={page - 1}">← Anterior</a>')
+            nav.append(f" Página {page} de {pages} ")
+            if page < pages:
+                nav.append(f'<a href="/list/{folder}?sort={sort}&order={order}&page={page + 1}">Siguiente →</a>')
+        nav.append("</p>")
+        return "".join(nav)
+
     def start_web_server(self):
         logging.info("[web_file_server] Iniciando servidor web en puerto 9666")
-        self.app.run(host='0.0.0.0', port=9666, debug=False, use_reloader=False)
+        serve(
+            self.app, '0.0.0.0', 9666,
+            backend=self.options.get('server', 'auto'),
+            threads=int(self.options.get('threads', SERVER_THREADS)),
+            max_connections=int(self.options.get('max_connections', MAX_CONNECTIONS)),
+        )
+
+    def index_logs(self):
+        # los logs se indexan según llegan a la carpeta, no en la petición que los busca; sigue
+        # en background como el servidor
+        while True:
+            try:
+                self._search_index().refresh()
+            except Exception as e:
+                logging.warning(f"[web_file_server] Error indexando los logs: {e}")
+            time.sleep(SEARCH_POLL)
 
     def on_loaded(self):
         if self.web_thread is None:
             self.web_thread = threading.Thread(target=self.start_web_server, daemon=True)
             self.web_thread.start()
+            threading.Thread(target=self.index_logs, daemon=True, name='web_file_server-index').start()
             logging.info("[web_file_server] Servidor web iniciado correctamente en http://<tu-ip>:9666")
 
     def on_unload(self, ui):
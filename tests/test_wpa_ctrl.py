@@ -0,0 +1,134 @@
+# WpaCtrl contra un socket de control falso: un servidor AF_UNIX de datagramas que responde como
+# wpa_supplicant y envía los eventos que indique cada prueba
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+try:
+    import pwnagotchi  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks", "stubs"))
+sys.path.insert(0, ROOT)
+
+import auto_nmap  # noqa: E402
+
+
+class FakeSupplicant:
+    def __init__(self, path, state="SCANNING", events=(), delay=0.05, early_event=None):
+        self.state = state
+        self.events = list(events)
+        self.delay = delay
+        # evento no solicitado que llega justo antes de la respuesta a STATUS
+        self.early_event = early_event
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.sock.settimeout(0.2)
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            command = data.decode()
+            if command == "PING":
+                reply = "PONG"
+            elif command == "STATUS":
+                reply = f"bssid=02:00:00:00:00:01\nwpa_state={self.state}"
+                if self.early_event:
+                    self.sock.sendto(f"<3>{self.early_event}".encode(), addr)
+                threading.Timer(self.delay, self._send_events, [addr]).start()
+            else:
+                reply = "OK"
+            self.sock.sendto(f"{reply}\n".encode(), addr)
+
+    def _send_events(self, addr):
+        for event in self.events:
+            try:
+                self.sock.sendto(f"<3>{event}".encode(), addr)
+            except OSError:
+                return
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+class WpaCtrlTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "wlan1")
+        self.server = None
+        self.ctrl = None
+
+    def tearDown(self):
+        if self.ctrl is not None:
+            self.ctrl.close()
+        if self.server is not None:
+            self.server.close()
+        self.tmp.cleanup()
+
+    def connect(self, **kwargs):
+        self.server = FakeSupplicant(self.path, **kwargs)
+        self.ctrl = auto_nmap.WpaCtrl(self.path)
+        self.ctrl.open(timeout=1)
+        self.ctrl.attach()
+        return self.ctrl
+
+    def test_request(self):
+        ctrl = self.connect()
+        self.assertEqual(ctrl.request("PING"), "PONG")
+
+    def test_open_missing_socket(self):
+        with self.assertRaises(FileNotFoundError):
+            auto_nmap.WpaCtrl(self.path).open(timeout=0.1)
+
+    def test_connected_event(self):
+        ctrl = self.connect(events=["CTRL-EVENT-SCAN-RESULTS", "CTRL-EVENT-CONNECTED - Connection to 02:00:00:00:00:01"])
+        self.assertTrue(ctrl.wait_connected(2))
+
+    def test_already_completed(self):
+        ctrl = self.connect(state="COMPLETED")
+        started = time.monotonic()
+        self.assertTrue(ctrl.wait_connected(2))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_rejected(self):
+        ctrl = self.connect(events=["CTRL-EVENT-ASSOC-REJECT bssid=02:00:00:00:00:01 status_code=17"])
+        started = time.monotonic()
+        self.assertFalse(ctrl.wait_connected(2))
+        # un rechazo corta la espera: no se agota el timeout
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_timeout(self):
+        ctrl = self.connect(events=["CTRL-EVENT-SCAN-RESULTS"])
+        started = time.monotonic()
+        self.assertFalse(ctrl.wait_connected(0.3))
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    def test_event_before_reply(self):
+        # un CONNECTED que llega mientras se espera la respuesta a STATUS no se pierde
+        ctrl = self.connect(early_event="CTRL-EVENT-CONNECTED - Connection to 02:00:00:00:00:01")
+        self.assertTrue(ctrl.wait_connected(0.5))
+
+    def test_flush_events(self):
+        ctrl = self.connect(events=["CTRL-EVENT-CONNECTED - Connection to 02:00:00:00:00:01"], delay=0)
+        ctrl.request("STATUS")
+        time.sleep(0.1)
+        ctrl.flush_events()
+        self.assertIsNone(ctrl.wait_event(("CTRL-EVENT-CONNECTED",), 0.2))
+
+
+if __name__ == "__main__":
+    unittest.main()